@@ -0,0 +1,56 @@
+"""
+Metadata extraction benchmark.
+
+Extracts the synthetic release names of the search benchmark one at a time,
+as a batch and on a process pool, and reports titles per second for each.
+
+    python benchmark_metadata.py
+    python benchmark_metadata.py --titles 500000 --workers 1 2 4 8
+"""
+
+import os
+import time
+import argparse
+from typing import Callable, List
+
+from metadata import extract, extract_batch, extract_parallel
+from benchmark_search import generate_corpus
+
+DEFAULT_TITLES = 200_000
+ROUNDS = 3
+
+
+def titles_per_second(run: Callable[[List[str]], object], titles: List[str]) -> float:
+    # Best of a few rounds, so a busy moment on the machine does not count
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        run(titles)
+        best = min(best, time.perf_counter() - started)
+    return len(titles) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--titles", type=int, default=DEFAULT_TITLES)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[2, os.cpu_count() or 1]
+    )
+    args = parser.parse_args()
+
+    titles = [name for name, _ in generate_corpus(args.titles, [])]
+    print(f"⚙️  Extracting {len(titles)} titles, best of {ROUNDS} rounds")
+
+    runs = [
+        ("extract", lambda names: [extract(name) for name in names]),
+        ("extract_batch", extract_batch),
+    ] + [
+        (f"extract_parallel x{workers}", lambda names, w=workers: extract_parallel(names, w))
+        for workers in sorted(set(args.workers))
+    ]
+    for label, run in runs:
+        print(f"   {label:<22} {titles_per_second(run, titles):>12,.0f} titles/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Search benchmark on a synthetic channel.
+
+Generates realistic release file names into a scratch index, replays a mix
+of requests against it and reports latency percentiles, rows returned and
+database size per corpus size and search mode.
+
+    python benchmark_search.py --sizes 10000 100000 1000000
+    python benchmark_search.py --label before --output before.json
+    python benchmark_search.py --compare before.json after.json
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List, Tuple
+
+from search_index import PAGE_SIZE, ResultCache, SearchEngine
+from indexing_with_sqlite import init_db, open_writer, write_batch
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_QUERIES = 2000
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "premium_group_bench")
+SEED = 42
+
+MODES = ["raw", "ranked", "fuzzy"]
+
+SYLLABLES = [
+    "ka", "ra", "ma", "na", "ta", "sa", "la", "da", "pa", "ba", "ja", "ha",
+    "ki", "ri", "mi", "ni", "ti", "si", "li", "di", "pi", "bi", "ji", "hi",
+    "ko", "ro", "mo", "no", "to", "so", "lo", "do", "po", "bo", "jo", "ho",
+    "kun", "ran", "man", "dan", "tan", "sin", "lok", "dev", "raj", "ram",
+]
+COMMON_WORDS = ["The", "Of", "And", "A", "In", "Return", "Night", "Last", "Rain"]
+QUALITIES = ["480p", "720p", "1080p", "2160p"]
+SOURCES = ["HDRip", "WEB-DL", "PreDVD", "WEBRip", "BluRay", "HDTV"]
+LANGUAGES = ["Hindi", "Hindi English", "Dual Audio [Hindi or Tamil]", "Tamil", "Korean"]
+CODECS = ["x264", "x265 HEVC", "10Bit x265", "AVC AAC"]
+GROUPS = [
+    "mkvCinemas",
+    "HDHub4u",
+    "Pahe",
+    "CineVood",
+    "YouthTrendx",
+    "www_HTPMovies_art",
+    "Vegamovies",
+    "Bollyflix",
+]
+SEPARATORS = [" ", ".", "_"]
+EXTENSIONS = ["mkv", "mp4"]
+
+
+def make_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+
+
+def make_title(rng: random.Random) -> str:
+    words = [make_word(rng) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.3:
+        words.insert(0, rng.choice(COMMON_WORDS))
+    return " ".join(words)
+
+
+def make_release(rng: random.Random, title: str, tag: str) -> str:
+    """
+    One upload of a title, named the way release groups do.
+    """
+    parts = [title, tag, rng.choice(QUALITIES)]
+    if rng.random() < 0.7:
+        parts.append(rng.choice(SOURCES))
+    parts += [rng.choice(LANGUAGES), rng.choice(CODECS)]
+    if rng.random() < 0.5:
+        parts.append("ESubs")
+
+    name = " ".join(parts)
+    separator = rng.choice(SEPARATORS)
+    if separator != " ":
+        name = name.replace(" ", separator)
+
+    group = rng.choice(GROUPS)
+    if group.startswith("www"):
+        name = f"{group}_{name}"
+    else:
+        name = f"{name} - {group}"
+    return f"{name}.{rng.choice(EXTENSIONS)}"
+
+
+def generate_corpus(size: int, catalog: List[Tuple[str, str]], seed: int = SEED):
+    """
+    Yield (file name, caption) pairs, recording each title used in `catalog`.
+
+    Movies come as `Title (Year)` in a few qualities, series as `Title SxxEyy`
+    with a run of episodes, so titles repeat the way they do in the channel.
+    """
+    rng = random.Random(seed)
+    produced = 0
+
+    while produced < size:
+        title = make_title(rng)
+
+        if rng.random() < 0.6:
+            year = rng.randint(1990, 2025)
+            catalog.append((title, str(year)))
+            uploads = [make_release(rng, title, f"({year})") for _ in range(rng.randint(1, 4))]
+        else:
+            season = rng.randint(1, 5)
+            catalog.append((title, f"S{season:02d}"))
+            uploads = [
+                make_release(rng, title, f"S{season:02d}E{episode:02d}")
+                for episode in range(1, rng.randint(4, 12))
+            ]
+
+        for name in uploads[: size - produced]:
+            yield name, f"{name}\n\n🔥 ᴊᴏɪɴ ➥ @{rng.choice(GROUPS)}"
+            produced += 1
+
+
+def build_corpus(path: str, size: int) -> Tuple[List[Tuple[str, str]], float]:
+    """
+    Create a scratch index with `size` synthetic files.
+
+    Returns:
+        Tuple: The (title, year or season) catalog and the load time
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    init_db(path)
+
+    started = time.perf_counter()
+    conn = open_writer(path)
+    catalog: List[Tuple[str, str]] = []
+    batch = []
+
+    for message_id, (name, caption) in enumerate(generate_corpus(size, catalog), 1):
+        batch.append((name, caption, message_id))
+        if len(batch) >= 10_000:
+            write_batch(conn, batch)
+            batch.clear()
+
+    write_batch(conn, batch)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return catalog, time.perf_counter() - started
+
+
+def make_typo(rng: random.Random, word: str) -> str:
+    i = rng.randrange(1, len(word))
+    return word[:i] + rng.choice("aeioukrst") + word[i + 1 :]
+
+
+def make_queries(
+    catalog: List[Tuple[str, str]], count: int, seed: int = SEED
+) -> Dict[str, List[str]]:
+    """
+    Request mix for each mode: mostly well-formed `Title Year` / `Title SXX`
+    requests, some single common words and some titles that do not exist.
+    The fuzzy mode replays the same requests with one typo each.
+    """
+    rng = random.Random(seed)
+    exact: List[str] = []
+
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.8:
+            title, tag = rng.choice(catalog)
+            exact.append(f"{title} {tag}")
+        elif roll < 0.9:
+            exact.append(rng.choice(COMMON_WORDS))
+        else:
+            exact.append(f"{make_word(rng)} {make_word(rng)}")
+
+    typos = []
+    for query in exact:
+        words = query.split()
+        longest = max(range(len(words)), key=lambda i: len(words[i]))
+        if len(words[longest]) > 3:
+            words[longest] = make_typo(rng, words[longest])
+        typos.append(" ".join(words))
+
+    return {"raw": exact, "ranked": exact, "fuzzy": typos}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_mode(path: str, mode: str, queries: List[str]) -> Dict[str, float]:
+    latencies, rows = [], []
+
+    if mode == "raw":
+        # The original search: whole-string prefix MATCH, unranked, unbounded
+        conn = sqlite3.connect(path)
+        for query in queries:
+            started = time.perf_counter()
+            try:
+                result = conn.execute(
+                    """
+                        SELECT media.original_title, media.message_id, media.quality
+                        FROM media_fts JOIN media ON media.id = media_fts.rowid
+                        WHERE media_fts MATCH ?
+                    """,
+                    (query + "*",),
+                ).fetchall()
+            except sqlite3.OperationalError:
+                result = []
+            latencies.append((time.perf_counter() - started) * 1000)
+            rows.append(len(result))
+        conn.close()
+    else:
+        engine = SearchEngine(path)
+        # Measure the index, not the result cache
+        engine.cache = ResultCache(max_entries=0)
+        for query in queries:
+            started = time.perf_counter()
+            page = engine.search(query, 0, PAGE_SIZE)
+            latencies.append((time.perf_counter() - started) * 1000)
+            rows.append(len(page.results))
+        engine.close()
+
+    return {
+        "queries": len(queries),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+        "mean_rows": statistics.fmean(rows),
+        "max_rows": max(rows),
+        "hit_rate": sum(1 for count in rows if count) / len(rows),
+    }
+
+
+def run(sizes: List[int], modes: List[str], query_count: int, workdir: str) -> List[Dict]:
+    os.makedirs(workdir, exist_ok=True)
+    report = []
+
+    for size in sizes:
+        path = os.path.join(workdir, f"corpus_{size}.db")
+        print(f"⚙️  Building {size:,} synthetic files in {path}...")
+        catalog, load_time = build_corpus(path, size)
+        db_size = os.path.getsize(path)
+        print(
+            f"   Loaded in {load_time:.1f}s ({size / load_time:,.0f} rows/s), "
+            f"{db_size / 1024 / 1024:.1f} MiB"
+        )
+
+        queries = make_queries(catalog, query_count)
+        for mode in modes:
+            result = run_mode(path, mode, queries[mode])
+            result.update(size=size, mode=mode, db_mib=db_size / 1024 / 1024)
+            report.append(result)
+            print_row(result)
+
+    return report
+
+
+def print_row(result: Dict):
+    print(
+        f"   {result['mode']:<7} n={result['size']:>9,}  "
+        f"p50={result['p50_ms']:7.2f}ms  p95={result['p95_ms']:7.2f}ms  "
+        f"p99={result['p99_ms']:7.2f}ms  rows(mean/max)={result['mean_rows']:.1f}/"
+        f"{result['max_rows']}  hits={result['hit_rate']:.0%}"
+    )
+
+
+def compare(before_file: str, after_file: str):
+    with open(before_file, "r") as f:
+        before = json.load(f)
+    with open(after_file, "r") as f:
+        after = json.load(f)
+
+    print(f"📊 {before['label']} → {after['label']}")
+    baseline = {(r["size"], r["mode"]): r for r in before["results"]}
+
+    for result in after["results"]:
+        old = baseline.get((result["size"], result["mode"]))
+        if old is None:
+            continue
+        print(
+            f"   {result['mode']:<7} n={result['size']:>9,}  "
+            + "  ".join(
+                f"{key}={old[key]:.2f}→{result[key]:.2f}"
+                for key in ("p50_ms", "p95_ms", "p99_ms", "mean_rows", "db_mib")
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--label", default=time.strftime("%Y-%m-%d %H:%M"))
+    parser.add_argument("--output", help="Save the results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args.sizes, args.modes, args.queries, args.workdir)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"label": args.label, "results": report}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
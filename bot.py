@@ -1,17 +1,30 @@
 import os
 import re
+import html
 import time
+import secrets
 import logging
 import asyncio
+import functools
 import threading
 from waitress import serve
 from dotenv import load_dotenv
 from flask import Flask, request
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from aiogram.filters import Command
 from typing import DefaultDict, Set
-from search_index import search_files
+from search_index import (
+    SearchBusyError,
+    get_engine,
+    parse_query,
+    search,
+    search_stats,
+    suggest_titles,
+)
 from utils import download_youtube_video
+from compact_index import compact, format_report
+from indexing_with_sqlite import LiveIndexer, duplicate_report, init_db
+from telethon import events
 from telethon.sync import TelegramClient
 from aiogram.types import Message, FSInputFile
 from datetime import datetime, timedelta, timezone
@@ -19,13 +32,27 @@ from aiogram import Bot, Dispatcher, Router, F, types
 from telethon.errors import RPCError, AuthKeyDuplicatedError
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from firebase import (
-    add_new_user,
-    process_removal_queue,
-    remove_user,
-    add_extra_7_days,
-    get_expiring_users,
-    get_stats,
+    add_extra_7_days_async,
+    add_new_user_async,
+    close_async,
+    complete_removal_async,
+    DAY,
+    REMINDER_DAYS,
+    REMOVAL_GRACE,
+    end_timestamp,
+    expiring_users_async,
+    format_timestamp,
+    get_stats_async,
+    get_user_async,
+    get_users_async,
+    mark_notified_async,
+    next_notice,
+    removal_deadlines_async,
+    remove_user_async,
+    start_user_store_async,
+    user_store,
 )
+from scheduler import DeadlineScheduler
 from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
@@ -86,6 +113,13 @@ is_shutting_down = False
 active_searches: DefaultDict[str, Set[asyncio.Task]] = defaultdict(set)
 search_msg = False
 
+# "More results" buttons waiting to be pressed: token -> (query, offset, user)
+MAX_PENDING_PAGES = 500
+
+# Applies uploads, edits and deletions in the database channel to the index
+live_index = LiveIndexer()
+pending_pages: "OrderedDict[str, tuple]" = OrderedDict()
+
 
 @dp.message(Command("start"))
 async def send_welcome(message: Message):
@@ -225,7 +259,7 @@ async def send_stats(message: Message):
 
     if member.status in ("administrator", "creator"):
         try:
-            user_count, total_amt = get_stats()
+            user_count, total_amt = await get_stats_async()
             response_msg = await message.answer(
                 f"📊 <b>Stats:\n\n👥 Users: {user_count}\n💰 Total Collected: ₹{total_amt}</b>",
                 parse_mode="HTML",
@@ -251,6 +285,133 @@ async def send_stats(message: Message):
         return
 
 
+@dp.message(F.text == "/search_stats")
+async def send_search_stats(message: Message):
+    # Make sure user id is not None
+    if message.from_user is None:
+        return
+
+    member = await bot.get_chat_member(
+        chat_id=PRIVATE_GROUP_ID, user_id=message.from_user.id
+    )
+
+    if member.status in ("administrator", "creator"):
+        stats = search_stats()
+        response_msg = await message.answer(
+            "🔎 <b>Search queue:</b>\n\n"
+            f"⏳ Queued: {stats['queued']} (peak {stats['max_queued']})\n"
+            f"⚙️ Running: {stats['running']}\n"
+            f"✅ Completed: {stats['completed']}\n"
+            f"⌛ Timed out: {stats['timeouts']}\n"
+            f"🚫 Cancelled: {stats['cancelled']}\n"
+            f"🙅 Rejected: {stats['rejected']}\n"
+            f"💥 Failed: {stats['failed']}\n"
+            f"🔤 Spelling fixes: {stats['fuzzy_hits']}/{stats['fuzzy_lookups']} "
+            f"({stats['fuzzy_timeouts']} over budget)\n"
+            f"♊ Duplicates skipped: {stats['duplicates_suppressed']}\n\n"
+            "🗂 <b>Result cache:</b>\n\n"
+            f"🎯 Hits: {stats['cache']['hits']}\n"
+            f"🔍 Misses: {stats['cache']['misses']}\n"
+            f"♻️ Evictions: {stats['cache']['evictions']}\n"
+            f"🧹 Invalidations: {stats['cache']['invalidations']}\n"
+            f"📦 Entries: {stats['cache']['entries']} "
+            f"({stats['cache']['bytes'] // 1024} KiB)",
+            parse_mode="HTML",
+        )
+
+        asyncio.create_task(delete_message_after_delay(response_msg, delay=30))
+        return
+    else:
+        response_msg = await message.answer(
+            "❌ *You are not allowed to use this command.*",
+            parse_mode="Markdown",
+        )
+
+        asyncio.create_task(delete_message_after_delay(response_msg, delay=7))
+        return
+
+
+@dp.message(F.text == "/duplicates")
+async def send_duplicates(message: Message):
+    # Make sure user id is not None
+    if message.from_user is None:
+        return
+
+    member = await bot.get_chat_member(
+        chat_id=PRIVATE_GROUP_ID, user_id=message.from_user.id
+    )
+
+    if member.status in ("administrator", "creator"):
+        report = await asyncio.to_thread(duplicate_report)
+
+        lines = []
+        for kind, channel, message_id, title, original_title in report["recent"]:
+            # Private channel links drop the -100 prefix of the chat ID
+            chat = str(channel or DATABASE_ID).removeprefix("-100")
+            lines.append(
+                f"{'♊' if kind == 'exact' else '❓'} "
+                f"<a href='https://t.me/c/{chat}/{message_id}'>{html.escape(title)}</a>\n"
+                f"      ↳ {html.escape(original_title or 'deleted')}"
+            )
+
+        response_msg = await message.answer(
+            "♊ <b>Duplicate files:</b>\n\n"
+            f"🎯 Exact: {report['exact']}\n"
+            f"❓ Likely: {report['likely']}\n\n"
+            + ("\n".join(lines) or "No duplicates found."),
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+        )
+
+        asyncio.create_task(delete_message_after_delay(response_msg, delay=120))
+        return
+    else:
+        response_msg = await message.answer(
+            "❌ *You are not allowed to use this command.*",
+            parse_mode="Markdown",
+        )
+
+        asyncio.create_task(delete_message_after_delay(response_msg, delay=7))
+        return
+
+
+@dp.message(F.text == "/compact")
+async def compact_search_index(message: Message):
+    # Make sure user id is not None
+    if message.from_user is None:
+        return
+
+    member = await bot.get_chat_member(
+        chat_id=PRIVATE_GROUP_ID, user_id=message.from_user.id
+    )
+
+    if member.status in ("administrator", "creator"):
+        status_msg = await message.answer("⚙️ *Compacting the search index...*", parse_mode="Markdown")
+
+        try:
+            # Searches keep running; only live index updates wait. Webhook
+            # handlers run on a loop of their own, so the pause is taken on
+            # the indexer's.
+            report = await live_index.run_paused(compact)
+            text = f"✅ <b>Search index compacted</b>\n\n<pre>{format_report(report)}</pre>"
+        except Exception as e:
+            logger.error(f"Compaction failed: {e}")
+            text = f"❌ <b>Compaction failed:</b> {html.escape(str(e))}"
+
+        response_msg = await status_msg.edit_text(text, parse_mode="HTML")
+        if isinstance(response_msg, Message):
+            asyncio.create_task(delete_message_after_delay(response_msg, delay=60))
+        return
+    else:
+        response_msg = await message.answer(
+            "❌ *You are not allowed to use this command.*",
+            parse_mode="Markdown",
+        )
+
+        asyncio.create_task(delete_message_after_delay(response_msg, delay=7))
+        return
+
+
 # TODO Pending to check bot activation in private chat
 @dp.message(F.new_chat_members)
 async def on_user_joined(message: Message):
@@ -302,13 +463,17 @@ async def on_user_joined(message: Message):
                 if user.is_bot:
                     continue
 
-                member = await bot.get_chat_member(
-                    chat_id=PRIVATE_GROUP_ID, user_id=user.id
-                )
-                if member.status in ("administrator", "creator"):
-                    continue
+                try:
+                    member = await bot.get_chat_member(
+                        chat_id=PRIVATE_GROUP_ID, user_id=user.id
+                    )
+                    if member.status in ("administrator", "creator"):
+                        continue
 
-                add_new_user(str(user.id))
+                    await add_new_user_async(str(user.id))
+                except Exception as e:
+                    # One failed member must not keep the rest from being added
+                    logger.error(f"❌ Failed to add user {user.id}: {e}")
 
             asyncio.create_task(delete_message_after_delay(response_msg, delay=20))
             return
@@ -377,7 +542,18 @@ async def add_seven_days_handler(message: Message):
 
             user_id = parts[1]
 
-            success = add_extra_7_days(user_id)
+            try:
+                success = await add_extra_7_days_async(user_id)
+            except asyncio.TimeoutError:
+                # The write still goes through; running the command again
+                # would add another 7 days
+                response_msg = await message.answer(
+                    "⏳ *Still saving the 7 extra days, check before trying again.*",
+                    parse_mode="Markdown",
+                )
+
+                asyncio.create_task(delete_message_after_delay(response_msg, delay=30))
+                return
             await message.delete()
 
             if success:
@@ -557,43 +733,108 @@ async def has_user_started_bot(user_id: int) -> bool:
         return False
 
 
-def start_expiry_monitoring(loop):
-    while True:
-        try:
-            logger.info("Expiry monitoring check...")
-            expiring_data = (
-                get_expiring_users()
-            )  # For testing pass test_mode=True as argument
-
-            if expiring_data is None:
-                time.sleep(30)
-                continue
-
-            # Notify users whose plans are expiring in 7 days
-            for user_id, end_date in expiring_data["soon"]:
-                asyncio.run_coroutine_threadsafe(
-                    notify_user_plan_expiry(user_id, end_date, days_left=7), loop
-                )
+# Plan reminders, expiries and removals, each at its own deadline
+expiry_scheduler = DeadlineScheduler()
 
-            # Notify and users whose plans have expired
-            for user_id, end_date in expiring_data["expired"]:
-                asyncio.run_coroutine_threadsafe(
-                    notify_user_plan_expiry(user_id, end_date, days_left=0), loop
-                )
 
-                # Remove user from the database
-                remove_user(user_id)
+def schedule_user(user_id: str, data):
+    """
+    Schedule the next plan notice of a user, or drop it. Runs for every
+    user at startup and for every change of the users mirror after that,
+    so added and extended plans move their deadline.
+    """
+    try:
+        notice = next_notice(data, time.time()) if isinstance(data, dict) else None
+    except (TypeError, ValueError) as e:
+        # A malformed end_date skips this user, not the whole scheduler
+        logger.error(f"⚠️ Can't schedule user {user_id}, bad plan end: {e}")
+        notice = None
+    if notice is None:
+        expiry_scheduler.cancel(("notice", user_id))
+        return
 
-                # Remove from the private group and database
-                asyncio.run_coroutine_threadsafe(
-                    remove_user_from_private_group(user_id, PRIVATE_GROUP_ID), loop
-                )
+    deadline, _ = notice
+    expiry_scheduler.schedule(
+        ("notice", user_id), deadline, functools.partial(send_plan_notice, user_id)
+    )
 
-        except Exception as e:
-            logger.error(f"💥 Error during monitoring loop: {e}")
 
-        # Wait 30 seconds before the next check
-        time.sleep(30)
+def schedule_removal(user_id: str, deadline: int):
+    expiry_scheduler.schedule(
+        ("removal", user_id), deadline, functools.partial(complete_removal_async, user_id)
+    )
+
+
+async def send_plan_notice(user_id: str):
+    data = await get_user_async(user_id)
+    try:
+        notice = next_notice(data, time.time()) if isinstance(data, dict) else None
+    except (TypeError, ValueError) as e:
+        logger.error(f"⚠️ Can't send plan notice to user {user_id}, bad plan end: {e}")
+        return
+    if notice is None:
+        return
+
+    deadline, kind = notice
+    if deadline > time.time():
+        # Extended meanwhile, or the reminder was skipped
+        schedule_user(user_id, data)
+        return
+
+    end_date = data.get("end_date") or format_timestamp(end_timestamp(data))
+    # Marking the user reschedules them for the next notice
+    await mark_notified_async(user_id, kind)
+
+    if kind == "soon":
+        await notify_user_plan_expiry(user_id, end_date, days_left=7)
+        return
+
+    await notify_user_plan_expiry(user_id, end_date, days_left=0)
+
+    # Remove user from the database after the grace period
+    try:
+        deadline = await remove_user_async(user_id)
+    except asyncio.TimeoutError:
+        # The removal is still queued; a retry of this job would find the
+        # user notified already and stop before scheduling it
+        deadline = int(time.time()) + REMOVAL_GRACE
+    schedule_removal(user_id, deadline)
+
+    # Remove from the private group
+    await remove_user_from_private_group(user_id, PRIVATE_GROUP_ID)
+
+
+async def schedule_expiring_users():
+    """
+    Until the users mirror is loaded, schedule only the plans ending within
+    the notice window, found with a range query on `end_ts`, and look again
+    a day later. Once loaded, the mirror schedules every user itself.
+    """
+    if user_store.loaded():
+        return
+
+    # Plans whose reminder falls before the next look
+    until = time.time() + (REMINDER_DAYS + 1) * DAY
+    for user_id, data in (await expiring_users_async(until)).items():
+        schedule_user(user_id, data)
+    expiry_scheduler.schedule(("expiring",), time.time() + DAY, schedule_expiring_users)
+
+
+async def start_expiry_scheduler() -> asyncio.Task:
+    # Subscribed before loading, so no change slips in between
+    user_store.subscribe(schedule_user)
+    await start_user_store_async()
+
+    if user_store.loaded():
+        for user_id, data in (await get_users_async()).items():
+            schedule_user(user_id, data)
+    else:
+        # As a job, so a failing query is retried instead of ending startup
+        expiry_scheduler.schedule(("expiring",), time.time(), schedule_expiring_users)
+    for user_id, deadline in (await removal_deadlines_async()).items():
+        schedule_removal(user_id, deadline)
+
+    return asyncio.create_task(expiry_scheduler.run())
 
 
 async def notify_user_plan_expiry(user_id: str, end_date: str, days_left: int):
@@ -747,52 +988,53 @@ async def fetch_and_send_file(
             reply_to_message_id=original_message_id,
         )
 
-        # Send the query to search for fetching the file from database
-        results = search_files(query)
+        # Send the query to search for fetching the top ranked page of files
+        page = await search(query)
+        results = page.results
         print(f"Result from db: {results}")
 
+        # Results may come from a respelled query, keep paging with it
+        shown_query = page.corrected or query
+
         # If files found then send it to respective user
         if results:
             # 🔁 Edit the "Searching..." message to say "Sending..."
             await bot.edit_message_text(
                 chat_id=reply_chat_id,
                 message_id=searching_msg.message_id,
-                text=f"📤 *Found {len(results)} result(s) for '{query}'*\n_Sending files..._",
+                text=f"📤 *Found {len(results)} best result(s) for '{shown_query}'*\n_Sending files..._",
                 parse_mode="Markdown",
             )
 
-            file_count = 0
-
-            # Data present in result = (title, message_id, quality)
-            for result in results:
-                title = result[0]
-                msg_id = result[1]
-
-                try:
-                    await bot.copy_message(
-                        chat_id=receiver,
-                        from_chat_id=DATABASE_ID,
-                        message_id=msg_id,
-                        protect_content=True,
-                    )
-
-                    file_count += 1
-                    logger.info(f"{file_count} => Sent: {title}")
-
-                except Exception as e:
-                    logger.info(f"⚠️ Failed to sent `{title}` (ID: {msg_id}): {e}")
+            file_count = await send_result_files(results, receiver)
 
             # Reply to the user's original message with their first name
             first_name = requester_name.split()[0]
 
             if file_count > 0:
+                # Offer the next page on demand instead of sending everything
+                more_markup = None
+                if page.next_offset is not None:
+                    more_markup = more_results_markup(
+                        shown_query, page.next_offset, receiver
+                    )
+
+                skipped = ""
+                if page.duplicates:
+                    skipped = f"\n_Skipped {page.duplicates} duplicate upload(s)._"
+
                 response_msg = await bot.send_message(
                     reply_chat_id,
-                    f"*Hey {first_name}, check your DM! I've sent total {file_count} files there. 📂*",
+                    f"*Hey {first_name}, check your DM! I've sent total {file_count} files there. 📂*{skipped}",
                     parse_mode="Markdown",
                     reply_to_message_id=original_message_id,
+                    reply_markup=more_markup,
+                )
+                asyncio.create_task(
+                    delete_message_after_delay(
+                        response_msg, delay=120 if more_markup else 10
+                    )
                 )
-                asyncio.create_task(delete_message_after_delay(response_msg, delay=10))
             else:
                 response_msg = await bot.send_message(
                     reply_chat_id,
@@ -803,9 +1045,19 @@ async def fetch_and_send_file(
                 asyncio.create_task(delete_message_after_delay(response_msg, delay=10))
 
         else:
+            # Suggest indexed titles that start like the requested one
+            title_words = parse_query(query).title_words
+            suggestions = await suggest_titles(" ".join(title_words), limit=3)
+            did_you_mean = "".join(
+                f"• `{title.replace('`', '')}`\n" for title in suggestions
+            )
+            if did_you_mean:
+                did_you_mean = f"*Did you mean:*\n{did_you_mean}\n"
+
             response_msg = await bot.send_message(
                 reply_chat_id,
                 "*🚫 No files found.*\n\n"
+                f"{did_you_mean}"
                 "*Please check your spelling and try again.*\n\n"
                 "*Not released on OTT.*\n\n*If the issue continues, contact the Owner/Admin.💡*\n\n"
                 "*Send in this format:*\n"
@@ -826,6 +1078,17 @@ async def fetch_and_send_file(
                 chat_id=reply_chat_id, message_id=searching_msg.message_id
             )
 
+    except (SearchBusyError, asyncio.TimeoutError) as e:
+        logger.warning(f"Search for '{query}' not served: {e!r}")
+        response_msg = await bot.send_message(
+            reply_chat_id,
+            "⏳ *Too many requests right now. Please try again in a minute.*",
+            parse_mode="Markdown",
+            reply_to_message_id=original_message_id,
+        )
+        search_msg = True
+        asyncio.create_task(delete_message_after_delay(response_msg, delay=20))
+
     except RPCError as e:
         logger.info(f"RPC Error: {e}")
         response_msg = await bot.send_message(
@@ -849,6 +1112,107 @@ async def fetch_and_send_file(
         asyncio.create_task(delete_message_after_delay(response_msg, delay=20))
 
 
+async def send_result_files(results, receiver: int) -> int:
+    """
+    Copy one page of search results to the user's DM.
+
+    Returns:
+        int: Number of files that were sent successfully
+    """
+    file_count = 0
+
+    # Data present in result = (title, message_id, quality, channel)
+    for result in results:
+        title = result[0]
+        msg_id = result[1]
+        # Files indexed before channels were recorded come from DATABASE_ID
+        from_chat_id = result[3] or DATABASE_ID
+
+        try:
+            await bot.copy_message(
+                chat_id=receiver,
+                from_chat_id=from_chat_id,
+                message_id=msg_id,
+                protect_content=True,
+            )
+
+            file_count += 1
+            logger.info(f"{file_count} => Sent: {title}")
+
+        except Exception as e:
+            logger.info(f"⚠️ Failed to sent `{title}` (ID: {msg_id}): {e}")
+
+    return file_count
+
+
+def more_results_markup(query: str, offset: int, receiver: int):
+    """
+    Build the "More results" button for the next page of a query.
+
+    Callback data is capped at 64 bytes, so the query is kept server side
+    and the button only carries a short token.
+    """
+    token = secrets.token_hex(4)
+    pending_pages[token] = (query, offset, receiver)
+
+    # Forget the oldest pages once too many buttons are outstanding
+    while len(pending_pages) > MAX_PENDING_PAGES:
+        pending_pages.popitem(last=False)
+
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="📥 More results", callback_data=f"more:{token}")]
+        ]
+    )
+
+
+@dp.callback_query(F.data.startswith("more:"))
+async def send_more_results(callback: types.CallbackQuery):
+    """
+    Send the next page of results for a previous request.
+    """
+    if callback.data is None:
+        return
+
+    token = callback.data.split(":", 1)[1]
+    pending = pending_pages.get(token)
+
+    if pending is None:
+        await callback.answer("⌛ This request has expired. Please search again.")
+        return
+
+    query, offset, receiver = pending
+
+    if callback.from_user.id != receiver:
+        await callback.answer("❌ Only the requester can get more results.")
+        return
+
+    # One press per page
+    del pending_pages[token]
+
+    try:
+        page = await search(query, offset=offset)
+    except (SearchBusyError, asyncio.TimeoutError) as e:
+        logger.warning(f"More results for '{query}' not served: {e!r}")
+        pending_pages[token] = pending
+        await callback.answer("⏳ Too many requests right now. Please try again.")
+        return
+
+    file_count = await send_result_files(page.results, receiver)
+    await callback.answer(f"📂 Sent {file_count} more files to your DM.")
+
+    # Swap the button for the following page, or drop it at the end
+    more_markup = None
+    if page.next_offset is not None:
+        more_markup = more_results_markup(query, page.next_offset, receiver)
+
+    if isinstance(callback.message, Message):
+        try:
+            await callback.message.edit_reply_markup(reply_markup=more_markup)
+        except TelegramBadRequest as e:
+            logger.warning(f"Could not update more results button: {e}")
+
+
 @dp.message()
 async def handle_query(message: Message):
     """
@@ -1060,6 +1424,18 @@ async def delete_message_after_delay(message: Message, delay: int):
         logger.error(f"Unexpected error while deleting message: {e}")
 
 
+async def on_database_message(event: events.NewMessage.Event):
+    live_index.upsert(event.chat_id, event.message)
+
+
+async def on_database_edit(event: events.MessageEdited.Event):
+    live_index.upsert(event.chat_id, event.message)
+
+
+async def on_database_delete(event: events.MessageDeleted.Event):
+    live_index.delete(event.chat_id, event.deleted_ids)
+
+
 async def discard_db_group_updates():
     """
     Discards all pending updates from the DB group before polling starts.
@@ -1130,6 +1506,7 @@ async def main():
     """
     # Initialize the client
     client = TelegramClient(SESSION_NAME, TELEGRAM_API_ID, TELEGRAM_API_HASH)
+    scheduler_task = None
 
     try:
         logger.info("Connecting Telethon user client...")
@@ -1139,6 +1516,25 @@ async def main():
             os._exit(1)
         logger.info("Telethon user client is running!")
 
+        # Bring the index schema up to date, then open the pooled search
+        # connections once, before any request comes in
+        init_db()
+        get_engine()
+
+        # Keep the index current from the database channel. Files indexed
+        # before channels were recorded all come from DATABASE_ID.
+        await live_index.start(legacy_chat_id=DATABASE_ID)
+        client.add_event_handler(
+            on_database_message, events.NewMessage(chats=DATABASE_ID)
+        )
+        client.add_event_handler(
+            on_database_edit, events.MessageEdited(chats=DATABASE_ID)
+        )
+        client.add_event_handler(
+            on_database_delete, events.MessageDeleted(chats=DATABASE_ID)
+        )
+        logger.info("Live index updates enabled for the database channel.")
+
         # Clean DB group messages before polling
         await discard_db_group_updates()
 
@@ -1147,7 +1543,11 @@ async def main():
 
         # Set Webhook
         webhook_url = f"https://{RENDER_EXTERNAL_HOSTNAME}/webhook"
-        await bot.set_webhook(webhook_url)
+        # List the update types explicitly: `discard_db_group_updates` narrows
+        # them to messages and Telegram keeps the last setting otherwise
+        await bot.set_webhook(
+            webhook_url, allowed_updates=["message", "callback_query"]
+        )
         logger.info(f"Webhook set to {webhook_url}")
 
         # Run Flask server in a separate thread
@@ -1156,20 +1556,9 @@ async def main():
         server_thread.start()
         logger.info("Flask server thread started.")
 
-        # Start monitoring expiry thread
-        loop = asyncio.get_running_loop()
-        monitoring_thread = threading.Thread(
-            target=start_expiry_monitoring, args=(loop,)
-        )
-        monitoring_thread.daemon = True
-        monitoring_thread.start()
-        logger.info("Expiry monitoring thread started.")
-
-        # Start removal processing thread
-        removal_thread = threading.Thread(target=process_removal_queue)
-        removal_thread.daemon = True
-        removal_thread.start()
-        logger.info("Removal processing thread started.")
+        # Load the users mirror and schedule every plan deadline from it
+        scheduler_task = await start_expiry_scheduler()
+        logger.info("Expiry scheduler started.")
 
         # Keep everything running
         logger.info("All services started successfully. Keeping the main loop alive...")
@@ -1184,6 +1573,10 @@ async def main():
         os._exit(1)  # Exit the process to suspend the service
 
     finally:
+        if scheduler_task is not None:
+            scheduler_task.cancel()
+        await live_index.close()
+        await close_async()
         await bot.delete_webhook()
         await bot.session.close()
         client.disconnect()
@@ -0,0 +1,221 @@
+"""
+Online compaction of the search index.
+
+Merges the segments of both full-text indexes, writes a vacuumed snapshot
+with `VACUUM INTO` and copies it back over the live database in a single
+write transaction. Searches keep running throughout: in WAL mode a query
+that started before the swap finishes on the pages it began with, and the
+next one sees the compacted file.
+
+With INDEX_SHARD_BY set, every shard in INDEX_SHARD_DIR is compacted in
+turn instead of the single database.
+
+    python compact_index.py
+    python compact_index.py --db index.db --queries 200
+"""
+
+import os
+import time
+import random
+import sqlite3
+import argparse
+import statistics
+from typing import Dict, List, Optional
+
+from search_index import PAGE_SIZE, ResultCache, SearchEngine, shard_files
+from indexing_with_sqlite import DB_FILE, SHARD_BY, SHARD_DIR, file_size, open_writer
+
+SAMPLE_QUERIES = 100
+# Attempts before giving up when other writers keep changing the index
+MAX_ATTEMPTS = 3
+# Pages copied back per backup step; the live file stays locked from the
+# first step to the last
+BACKUP_STEP_PAGES = 4096
+
+
+class CompactionConflict(Exception):
+    """
+    The index changed while the snapshot was written.
+    """
+
+
+def sample_queries(db_file: str, count: int = SAMPLE_QUERIES) -> List[str]:
+    """
+    Requests made of the first words of randomly picked indexed titles.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        keys = [
+            key
+            for key, in conn.execute(
+                "SELECT search_key FROM media WHERE search_key != '' ORDER BY random() LIMIT ?",
+                (count,),
+            )
+        ]
+    finally:
+        conn.close()
+
+    rng = random.Random(len(keys))
+    queries = []
+    for key in keys:
+        words = key.split()
+        queries.append(" ".join(words[: rng.randint(1, min(3, len(words)))]))
+    return queries
+
+
+def measure_latency(
+    db_file: str, queries: List[str], shard_dir: Optional[str] = None
+) -> Dict[str, float]:
+    if not queries:
+        return {"p50_ms": 0.0, "p95_ms": 0.0}
+
+    engine = SearchEngine(db_file, pool_size=1, shard_dir=shard_dir)
+    # Measure the index, not the result cache
+    engine.cache = ResultCache(max_entries=0)
+    latencies = []
+    try:
+        for query in queries:
+            started = time.perf_counter()
+            engine.search(query, 0, PAGE_SIZE)
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        engine.close()
+
+    cuts = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else latencies * 19
+    return {"p50_ms": statistics.median(latencies), "p95_ms": cuts[18]}
+
+
+def swap_in_snapshot(conn: sqlite3.Connection, db_file: str, snapshot_file: str):
+    """
+    Write a vacuumed copy of the index and copy it back over the live file.
+
+    Commits of other connections are watched through a connection of their
+    own, since the backup keeps `conn` busy. The check runs after each
+    backup step but the last: from the first one on the backup holds the
+    write lock, so a commit that got in before it is caught before the copy
+    completes. The copy always takes two steps or more for that reason.
+
+    Raises:
+        CompactionConflict: Another connection committed in between; the
+            partial copy is rolled back, so that write is kept
+    """
+    if os.path.exists(snapshot_file):
+        os.remove(snapshot_file)
+
+    probe = sqlite3.connect(db_file)
+    snapshot = None
+    try:
+        version = probe.execute("PRAGMA data_version").fetchone()[0]
+        conn.execute("VACUUM INTO ?", (snapshot_file,))
+
+        def check(status, remaining, total):
+            # Nothing remains once the copy is committed
+            if remaining and probe.execute("PRAGMA data_version").fetchone()[0] != version:
+                raise CompactionConflict("the index changed while the snapshot was written")
+
+        # One write transaction over every step, so readers see either file whole
+        snapshot = sqlite3.connect(snapshot_file)
+        pages = snapshot.execute("PRAGMA page_count").fetchone()[0]
+        snapshot.backup(conn, pages=max(1, min(BACKUP_STEP_PAGES, pages - 1)), progress=check)
+    finally:
+        if snapshot is not None:
+            snapshot.close()
+        probe.close()
+        if os.path.exists(snapshot_file):
+            os.remove(snapshot_file)
+
+    # Shrink the WAL back down; pages still read by older queries stay put
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def compact(
+    db_file: str = DB_FILE,
+    query_count: int = SAMPLE_QUERIES,
+    shard_dir: Optional[str] = SHARD_DIR if SHARD_BY else None,
+) -> Dict:
+    """
+    Compact the index in place and measure the effect. Given a `shard_dir`,
+    as when sharding is on, each of its shards is compacted instead of
+    `db_file` and the latency is that of searching all of them.
+
+    Writers in other processes are not stopped; if one commits during the
+    snapshot the swap is retried, so pause in-process writers first.
+
+    Returns:
+        dict: Total sizes in bytes and search latencies before and after,
+            the number of files compacted and the time it took
+
+    Raises:
+        ValueError: Sharding is on but there are no shards to compact
+    """
+    files = shard_files(shard_dir) if shard_dir is not None else [db_file]
+    if not files:
+        raise ValueError(f"no shards in {shard_dir}")
+
+    per_file = max(1, query_count // len(files))
+    queries = [query for path in files for query in sample_queries(path, per_file)]
+    report = {
+        "files": len(files),
+        "size_before": sum(map(file_size, files)),
+        "latency_before": measure_latency(db_file, queries, shard_dir),
+    }
+
+    started = time.perf_counter()
+    for path in files:
+        compact_file(path)
+
+    report["elapsed"] = time.perf_counter() - started
+    report["size_after"] = sum(map(file_size, files))
+    report["latency_after"] = measure_latency(db_file, queries, shard_dir)
+    return report
+
+
+def compact_file(db_file: str):
+    conn = open_writer(db_file)
+    try:
+        # Merge every FTS segment into one b-tree per index
+        with conn:
+            conn.execute("INSERT INTO media_fts (media_fts) VALUES ('optimize')")
+            conn.execute("INSERT INTO title_trigrams (title_trigrams) VALUES ('optimize')")
+
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                swap_in_snapshot(conn, db_file, f"{db_file}.compact")
+                break
+            except CompactionConflict:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                print(
+                    f"⚠️ {db_file} changed during compaction, retrying ({attempt}/{MAX_ATTEMPTS})"
+                )
+    finally:
+        conn.close()
+
+
+def format_report(report: Dict) -> str:
+    before, after = report["latency_before"], report["latency_after"]
+    files = f"Files: {report['files']}\n" if report["files"] > 1 else ""
+    return (
+        files
+        + f"Size: {report['size_before'] / 1024 / 1024:.1f} MiB → "
+        f"{report['size_after'] / 1024 / 1024:.1f} MiB\n"
+        f"Search p50: {before['p50_ms']:.2f} → {after['p50_ms']:.2f} ms\n"
+        f"Search p95: {before['p95_ms']:.2f} → {after['p95_ms']:.2f} ms\n"
+        f"Took {report['elapsed']:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--queries", type=int, default=SAMPLE_QUERIES)
+    args = parser.parse_args()
+
+    shard_dir = SHARD_DIR if SHARD_BY else None
+    print(f"⚙️  Compacting {shard_dir or args.db}...")
+    report = compact(args.db, args.queries, shard_dir)
+    print(f"✅ {format_report(report)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,517 @@
+"""
+Export the search index for backups, and restore it.
+
+    snapshot      Binary copy made with the online backup API
+    dump          SQL text dump streamed through gzip (.gz) or zstd (.zst)
+    incremental   Files added, changed or removed since the previous export,
+                  as compressed JSON lines
+    restore       Load any of the above into a database
+
+Every export records how far it got, so an incremental export continues
+from the last snapshot, dump or incremental export. Restoring a snapshot
+or dump followed by the incremental exports made after it, in order,
+gives back the index as of the last one. Changed and removed files are
+only logged from the first snapshot or dump on, one entry per file, and
+each export clears what it covered. Point the paths at the storage of the
+backup account.
+
+    python export.py snapshot backups/index.db
+    python export.py dump backups/index.sql.gz
+    python export.py incremental backups/index-0001.jsonl.zst
+    python export.py restore backups/index.db --db restored.db
+    python export.py restore backups/index-0001.jsonl.zst --db restored.db
+"""
+
+import io
+import os
+import gzip
+import json
+import time
 import sqlite3
+import argparse
+from typing import Dict, Iterator, List, Tuple
+
+from indexing_with_sqlite import (
+    CHANGE_LOG_KEY,
+    DB_FILE,
+    DUPLICATE_COLUMNS,
+    MEDIA_COLUMNS,
+    MEDIA_INSERT_SQL,
+    bump_generation,
+    open_writer,
+)
+
+# Pages copied per backup step; the source is only locked during a step
+BACKUP_PAGES_PER_STEP = 1024
+# Rows per statement when restoring an incremental export
+RESTORE_CHUNK = 10_000
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+FORMAT_VERSION = 1
+
+# Small tables copied whole into every incremental export
+FULL_TABLES = {
+    "duplicate_files": DUPLICATE_COLUMNS,
+    "index_checkpoints": ["channel", "last_message_id"],
+}
+
+# Position of the last export, kept in `index_meta` of the exported database
+# and of every snapshot and dump
+EXPORT_KEYS = ("export_media_id", "export_change_seq")
+
+POSITION_SQL = """
+    SELECT
+        (SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'media'),
+        (SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'media_changes')
+"""
+
+
+def file_size_mib(path: str) -> float:
+    return os.path.getsize(path) / 1024 / 1024
+
+
+def open_text(path: str, mode: str) -> io.TextIOBase:
+    """
+    Open a text file, compressed according to its extension.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=GZIP_LEVEL)
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd exports need the zstandard package: pip install zstandard")
+        return zstandard.open(
+            path,
+            mode + "t",
+            cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL),
+            encoding="utf-8",
+        )
+    return open(path, mode, encoding="utf-8")
+
+
+def partial_path(path: str) -> str:
+    # Written next to the export and renamed once complete; the extension
+    # stays last so the same compression is used
+    root, extension = os.path.splitext(path)
+    return f"{root}.partial{extension}"
+
+
+def print_progress(status: int, remaining: int, total: int):
+    done = total - remaining
+    # About every tenth of the file
+    if remaining == 0 or done * 10 // total > (done - BACKUP_PAGES_PER_STEP) * 10 // total:
+        print(f"   {done}/{total} pages ({done * 100 // total}%)")
+
+
+def read_position(conn: sqlite3.Connection) -> Tuple[int, int]:
+    media_id, change_seq = conn.execute(POSITION_SQL).fetchone()
+    return media_id, change_seq
+
+
+def exported_position(conn: sqlite3.Connection) -> Dict[str, int]:
+    return dict(
+        conn.execute(
+            f"SELECT key, value FROM index_meta WHERE key IN ({', '.join('?' * len(EXPORT_KEYS))})",
+            EXPORT_KEYS,
+        ).fetchall()
+    )
+
+
+def save_position(conn: sqlite3.Connection, media_id: int, change_seq: int):
+    conn.executemany(
+        """
+            INSERT INTO index_meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """,
+        zip(EXPORT_KEYS, (media_id, change_seq)),
+    )
+
+
+def start_change_log(db_file: str):
+    """
+    Log changed and removed files from now on, for the incremental exports
+    that continue from this one. Until the first export nothing is logged,
+    so an index that is never exported keeps no log.
+    """
+    conn = open_writer(db_file)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO index_meta (key, value) VALUES (?, 1)", (CHANGE_LOG_KEY,)
+            )
+    finally:
+        conn.close()
+
+
+def mark_exported(db_file: str, media_id: int, change_seq: int):
+    """
+    Remember what the latest export covers, and forget the changes it
+    included. Writes made since stay above the saved position.
+    """
+    conn = open_writer(db_file)
+    try:
+        with conn:
+            save_position(conn, media_id, change_seq)
+            conn.execute("DELETE FROM media_changes WHERE seq <= ?", (change_seq,))
+    finally:
+        conn.close()
+
+
+def export_snapshot(db_file: str, path: str):
+    """
+    Copy the database page by page. Writers are only held off while a
+    step runs, and pages they change mid-copy are copied again.
+    """
+    started = time.perf_counter()
+    partial = partial_path(path)
+    if os.path.exists(partial):
+        os.remove(partial)
+    # Before the copy, so no change made after it goes unlogged
+    start_change_log(db_file)
+
+    source = sqlite3.connect(db_file)
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=print_progress)
+        # The copy itself says what it contains
+        media_id, change_seq = read_position(target)
+        with target:
+            save_position(target, media_id, change_seq)
+    finally:
+        target.close()
+        source.close()
+
+    os.replace(partial, path)
+    mark_exported(db_file, media_id, change_seq)
+    print(
+        f"✅ Snapshot written to {path} in {time.perf_counter() - started:.1f}s "
+        f"({file_size_mib(path):.1f} MiB)"
+    )
+
+
+def dump_statements(conn: sqlite3.Connection) -> Iterator[str]:
+    """
+    SQL statements that recreate the database.
+
+    Unlike `iterdump`, the full-text indexes are not dumped: they are
+    external-content tables over `media`, so the dump recreates them empty
+    and rebuilds them once the rows are in. Indexes and triggers come last,
+    so loading the rows does not maintain them row by row.
+    """
+    objects = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY rowid"
+    ).fetchall()
+    virtual = [name for _, name, sql in objects if sql.upper().startswith("CREATE VIRTUAL TABLE")]
+
+    yield "BEGIN TRANSACTION;"
+    for kind, name, sql in objects:
+        # Shadow tables of the full-text indexes hold index data only
+        if kind != "table" or name in virtual or name.startswith(("sqlite_", *(f"{v}_" for v in virtual))):
+            continue
+        yield f"{sql};"
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+        values = " || ',' || ".join(f'quote("{column}")' for column in columns)
+        for (statement,) in conn.execute(
+            f"""SELECT 'INSERT INTO "{name}" VALUES(' || {values} || ');' FROM "{name}" """
+        ):
+            yield statement
+
+    yield "DELETE FROM sqlite_sequence;"
+    for name, seq in conn.execute("SELECT name, seq FROM sqlite_sequence"):
+        yield f"INSERT INTO sqlite_sequence (name, seq) VALUES ('{name}', {seq});"
+
+    for name in virtual:
+        sql = next(sql for _, other, sql in objects if other == name)
+        yield f"{sql};"
+        yield f"""INSERT INTO "{name}" ("{name}") VALUES ('rebuild');"""
+    for kind, name, sql in objects:
+        if kind in ("index", "trigger"):
+            yield f"{sql};"
+    yield "COMMIT;"
+
+
+def export_dump(db_file: str, path: str):
+    """
+    Stream an SQL dump of the database through the compressor, without
+    holding the text in memory.
+    """
+    started = time.perf_counter()
+    partial = partial_path(path)
+    start_change_log(db_file)
+
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        # One read transaction, so the dump and its position agree
+        conn.execute("BEGIN")
+        media_id, change_seq = read_position(conn)
+        statements = 0
+        with open_text(partial, "w") as f:
+            for line in dump_statements(conn):
+                f.write(f"{line}\n")
+                statements += 1
+            for key, value in zip(EXPORT_KEYS, (media_id, change_seq)):
+                f.write(f"INSERT OR REPLACE INTO index_meta (key, value) VALUES ('{key}', {value});\n")
+        conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+
+    os.replace(partial, path)
+    mark_exported(db_file, media_id, change_seq)
+    print(
+        f"✅ Dumped {statements} statements to {path} in {time.perf_counter() - started:.1f}s "
+        f"({file_size_mib(path):.1f} MiB)"
+    )
+
+
+def export_incremental(db_file: str, path: str):
+    """
+    Write the files added, changed or removed since the previous export,
+    plus the small bookkeeping tables in full.
+    """
+    started = time.perf_counter()
+    partial = partial_path(path)
+
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        previous = exported_position(conn)
+        if len(previous) < len(EXPORT_KEYS):
+            print("❌ Nothing to continue from, make a snapshot or dump first")
+            conn.execute("ROLLBACK")
+            return
+
+        from_id, from_seq = (previous[key] for key in EXPORT_KEYS)
+        media_id, change_seq = read_position(conn)
+        changed = json.dumps(
+            [
+                row[0]
+                for row in conn.execute(
+                    "SELECT DISTINCT id FROM media_changes WHERE seq > ?", (from_seq,)
+                )
+            ]
+        )
+        # Removed rows go first: an edit re-adds its message under a new ID
+        removed = [
+            row[0]
+            for row in conn.execute(
+                "SELECT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM media)",
+                (changed,),
+            )
+        ]
+
+        upserts = 0
+        with open_text(partial, "w") as f:
+            header = {
+                "format": FORMAT_VERSION,
+                "from": [from_id, from_seq],
+                "to": [media_id, change_seq],
+                "columns": MEDIA_COLUMNS,
+            }
+            f.write(json.dumps(header) + "\n")
+
+            for media_row_id in removed:
+                f.write(json.dumps({"delete": media_row_id}) + "\n")
+            for row in conn.execute(
+                f"""
+                    SELECT {', '.join(MEDIA_COLUMNS)} FROM media
+                    WHERE id > ? OR id IN (SELECT value FROM json_each(?))
+                """,
+                (from_id, changed),
+            ):
+                f.write(json.dumps({"media": row}) + "\n")
+                upserts += 1
+
+            for table, columns in FULL_TABLES.items():
+                rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall()
+                f.write(json.dumps({"table": table, "columns": columns, "rows": rows}) + "\n")
+            meta = conn.execute(
+                f"SELECT key, value FROM index_meta WHERE key NOT IN ({', '.join('?' * len(EXPORT_KEYS))})",
+                EXPORT_KEYS,
+            ).fetchall()
+            f.write(json.dumps({"table": "index_meta", "columns": ["key", "value"], "rows": meta}) + "\n")
+        conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+
+    os.replace(partial, path)
+    mark_exported(db_file, media_id, change_seq)
+    print(
+        f"✅ {upserts} files written and {len(removed)} removed since the last export, "
+        f"to {path} in {time.perf_counter() - started:.1f}s ({file_size_mib(path):.3f} MiB)"
+    )
+
+
+def read_statements(path: str) -> Iterator[str]:
+    """
+    Complete SQL statements of a dump, one at a time. Text values may
+    contain newlines, so lines are joined until the statement is complete.
+    """
+    statement = ""
+    with open_text(path, "r") as f:
+        for line in f:
+            statement += line
+            if sqlite3.complete_statement(statement):
+                yield statement
+                statement = ""
+
+
+def restore_snapshot(path: str, db_file: str):
+    started = time.perf_counter()
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    target = sqlite3.connect(db_file)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=print_progress)
+    finally:
+        target.close()
+        source.close()
+    print(f"✅ Restored {db_file} from {path} in {time.perf_counter() - started:.1f}s")
+
+
+def restore_dump(path: str, db_file: str):
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    statements = 0
+    try:
+        for statement in read_statements(path):
+            conn.execute(statement)
+            statements += 1
+    finally:
+        conn.close()
+    print(
+        f"✅ Restored {db_file} from {statements} statements of {path} "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def restore_incremental(path: str, db_file: str):
+    """
+    Apply an incremental export on top of the snapshot, dump or
+    incremental export it continues from.
+    """
+    started = time.perf_counter()
+    with open_text(path, "r") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} has unknown format {header.get('format')}")
+
+        conn = open_writer(db_file)
+        try:
+            position = exported_position(conn)
+            if [position.get(key) for key in EXPORT_KEYS] != header["from"]:
+                raise ValueError(
+                    f"{path} continues from export {header['from']}, but {db_file} is at "
+                    f"{[position.get(key) for key in EXPORT_KEYS]}; restore the exports in order"
+                )
+
+            columns = header["columns"]
+            upserts: List[list] = []
+            deletes: List[int] = []
+            tables = []
+            written = removed = 0
+            with conn:
+                cursor = conn.cursor()
+                for line in f:
+                    item = json.loads(line)
+                    if "delete" in item:
+                        deletes.append(item["delete"])
+                        removed += 1
+                        continue
+                    if deletes:
+                        # All removals come first, before any row could clash
+                        delete_media(cursor, deletes)
+                        deletes = []
+                    if "media" in item:
+                        values = dict(zip(columns, item["media"]))
+                        upserts.append([values.get(column) for column in MEDIA_COLUMNS])
+                        written += 1
+                        if len(upserts) >= RESTORE_CHUNK:
+                            apply_media(cursor, upserts)
+                            upserts = []
+                    else:
+                        tables.append(item)
+                delete_media(cursor, deletes)
+                apply_media(cursor, upserts)
+
+                for table in tables:
+                    names = ", ".join(table["columns"])
+                    if table["table"] == "index_meta":
+                        cursor.execute(
+                            f"DELETE FROM index_meta WHERE key NOT IN ({', '.join('?' * len(EXPORT_KEYS))})",
+                            EXPORT_KEYS,
+                        )
+                    else:
+                        cursor.execute(f"DELETE FROM {table['table']}")
+                    cursor.executemany(
+                        f"INSERT INTO {table['table']} ({names}) VALUES ({', '.join('?' * len(table['columns']))})",
+                        table["rows"],
+                    )
+
+                # Changes applied here are not local edits to export again
+                cursor.execute("DELETE FROM media_changes")
+                save_position(conn, *header["to"])
+                bump_generation(cursor)
+        finally:
+            conn.close()
+
+    print(
+        f"✅ Applied {path} to {db_file}: {written} files written, {removed} removed, "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def delete_media(cursor: sqlite3.Cursor, ids: List[int]):
+    cursor.execute(
+        "DELETE FROM media WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+    )
+
+
+def apply_media(cursor: sqlite3.Cursor, rows: List[list]):
+    # Delete first: REPLACE would skip the triggers that keep the full-text
+    # indexes in step
+    delete_media(cursor, [row[0] for row in rows])
+    cursor.execute(MEDIA_INSERT_SQL, (json.dumps(rows),))
+
+
+def restore(path: str, db_file: str, force: bool = False):
+    name = path[: -len(os.path.splitext(path)[1])] if path.endswith((".gz", ".zst")) else path
+
+    if name.endswith(".jsonl"):
+        restore_incremental(path, db_file)
+        return
+
+    if os.path.exists(db_file) and not force:
+        print(f"❌ {db_file} exists, pass --force to replace it")
+        return
+    if name.endswith(".sql"):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        restore_dump(path, db_file)
+    else:
+        restore_snapshot(path, db_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["snapshot", "dump", "incremental", "restore"])
+    parser.add_argument("path", help="Export file to write, or to restore from")
+    parser.add_argument("--db", default=DB_FILE, help="Database to export or restore into")
+    parser.add_argument(
+        "--force", action="store_true", help="Let restore replace an existing database"
+    )
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        export_snapshot(args.db, args.path)
+    elif args.command == "dump":
+        export_dump(args.db, args.path)
+    elif args.command == "incremental":
+        export_incremental(args.db, args.path)
+    else:
+        restore(args.path, args.db, args.force)
+
 
-conn = sqlite3.connect("index.db")
-with open("database_dump.txt", "w", encoding="utf-8") as f:
-    for line in conn.iterdump():
-        f.write(f"{line}\n")
-print("Database dumped to database_dump.txt")
+if __name__ == "__main__":
+    main()
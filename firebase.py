@@ -1,7 +1,13 @@
+import copy
 import time
 import pytz
+import asyncio
 import logging
+import weakref
+import threading
 import firebase_admin
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
 from datetime import datetime, timedelta
 from firebase_admin import credentials, db
 
@@ -21,6 +27,424 @@ firebase_admin.initialize_app(
 # Get IST timezone
 india = pytz.timezone("Asia/Kolkata")
 
+# Dates as shown to users. Expiry is also stored as `end_ts`, epoch seconds,
+# which Firebase can order and range-query (see database.rules.json)
+DATE_FORMAT = "%d-%m-%Y %I:%M:%S %p"
+DAY = 24 * 60 * 60
+REMINDER_DAYS = 7
+
+# Time between queueing a user for removal and removing them
+REMOVAL_GRACE = DAY
+
+# Notification marks and removals are written in batches: whatever is queued
+# within a tick goes out as one multi-path update of at most
+# WRITE_BATCH_PATHS paths, retried WRITE_RETRIES times
+WRITE_TICK = 1.0
+WRITE_BATCH_PATHS = 500
+WRITE_RETRIES = 3
+WRITE_RETRY_DELAY = 2.0
+
+# The async functions below run the blocking calls on their own threads,
+# so handlers never wait on Firebase inside the event loop
+FIREBASE_WORKERS = 4
+FIREBASE_TIMEOUT = 10  # Seconds before an async call gives up
+
+# Seconds `UserStore.start` waits for the first snapshot of `users`
+USERS_LOAD_TIMEOUT = 30
+
+# How often the users listener is checked, and how long it may stay silent.
+# The SDK reconnects at least hourly to refresh its token and every
+# reconnect starts with a full snapshot, so a longer silence means it died.
+LISTENER_CHECK_INTERVAL = 60
+LISTENER_STALE_AFTER = 2 * 60 * 60
+
+
+def _set_path(tree: dict, parts: list, value):
+    # Set, or delete for None, the node at `parts` below `tree`
+    *parents, leaf = parts
+    node = tree
+    trail = []
+    for key in parents:
+        child = node.get(key)
+        if not isinstance(child, dict):
+            if value is None:
+                return
+            child = node[key] = {}
+        trail.append((node, key))
+        node = child
+
+    if value is not None:
+        node[leaf] = value
+        return
+
+    node.pop(leaf, None)
+    # Firebase keeps no empty nodes, so neither does the mirror
+    for parent, key in reversed(trail):
+        if parent[key]:
+            break
+        del parent[key]
+
+
+def end_timestamp(data: dict) -> Optional[int]:
+    # Users added before `end_ts` existed only have the `end_date` string
+    end_ts = data.get("end_ts")
+    if isinstance(end_ts, (int, float)):
+        return int(end_ts)
+
+    end_date = data.get("end_date")
+    if not end_date:
+        return None
+    return int(india.localize(datetime.strptime(end_date, DATE_FORMAT)).timestamp())
+
+
+def format_timestamp(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, india).strftime(DATE_FORMAT)
+
+
+class UserStore:
+    """
+    Local mirror of the `users` node. It is loaded once by a streaming
+    listener, which then applies every change as it arrives, so reads
+    never download the tree. A dead or failing listener is replaced and the
+    mirror resynced from the fresh snapshot; until the first snapshot
+    arrives, reads go to Firebase directly.
+    """
+
+    def __init__(self, path: str = "users"):
+        self.path = path
+        self._users = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._resync = threading.Event()
+        self._stopped = threading.Event()
+        self._registration = None
+        self._watchdog = None
+        self._last_event = 0.0
+        self._subscribers = []
+
+    def subscribe(self, callback: Callable[[str, Optional[dict]], None]):
+        """
+        Call `callback(user_id, fields)` after every change to a user, with
+        None once the user is deleted. It runs on the thread that applied
+        the change, usually the listener's.
+        """
+        self._subscribers.append(callback)
+
+    def start(self):
+        with self._start_lock:
+            if self._watchdog is not None:
+                return
+            self._stopped.clear()
+            try:
+                self._listen()
+            except Exception as e:
+                logger.error(f"💥 Users listener failed to start: {e}")
+                self._resync.set()
+
+            self._watchdog = threading.Thread(target=self._watch, daemon=True)
+            self._watchdog.start()
+
+        if self._loaded.wait(USERS_LOAD_TIMEOUT):
+            logger.info(f"👥 Users mirror loaded with {self.count()} users.")
+        else:
+            logger.warning("⚠️  Users mirror not loaded yet, reading from Firebase meanwhile.")
+
+    def close(self):
+        with self._start_lock:
+            self._stopped.set()
+            self._close_listener()
+            if self._watchdog is not None:
+                self._watchdog.join()
+                self._watchdog = None
+
+    def _listen(self):
+        self._last_event = time.monotonic()
+        # The first event is a put at "/" with the whole node
+        self._registration = db.reference(self.path).listen(self._on_event)
+
+    def _close_listener(self):
+        registration, self._registration = self._registration, None
+        if registration is None:
+            return
+        try:
+            registration.close()
+        except Exception as e:
+            logger.error(f"Error closing users listener: {e}")
+
+    def _listener_alive(self) -> bool:
+        # The registration does not report a dropped stream, but its thread
+        # ends with it
+        thread = getattr(self._registration, "_thread", None)
+        return thread is None or thread.is_alive()
+
+    def _watch(self):
+        while not self._stopped.wait(LISTENER_CHECK_INTERVAL):
+            silent = time.monotonic() - self._last_event
+            if (
+                self._resync.is_set()
+                or self._registration is None
+                or not self._listener_alive()
+                or silent > LISTENER_STALE_AFTER
+            ):
+                self._reconnect()
+
+    def _reconnect(self):
+        logger.warning("🔄 Users listener lost, reconnecting and resyncing...")
+        self._close_listener()
+        self._resync.clear()
+        try:
+            self._listen()
+        except Exception as e:
+            logger.error(f"💥 Users listener reconnect failed: {e}")
+            # Try again on the next check
+            self._resync.set()
+
+    def resync(self):
+        """Replace the listener on the next check, reloading the mirror."""
+        self._resync.set()
+
+    def _on_event(self, event):
+        # Runs on the listener thread, which ends if this raises
+        self._last_event = time.monotonic()
+        try:
+            self.apply(event.event_type, event.path, event.data)
+        except Exception as e:
+            logger.error(f"💥 Error applying users event at {event.path}: {e}")
+            self._resync.set()
+
+    def apply(self, event_type: str, path: str, data):
+        """
+        Apply a change at `path` below the users node, in the form of a
+        listener event. Writes made here are applied right away as well, so
+        they are seen even before the listener echoes them.
+
+        Args:
+            event_type: "put" replaces the node at `path`, "patch" sets
+                each child of `data`, which may be multi-part paths.
+            path: "/" for the whole node, "/<user_id>" or deeper.
+            data: The new value; None deletes.
+        """
+        parts = [part for part in path.split("/") if part]
+        with self._lock:
+            if event_type == "put" and not parts:
+                if data is not None and not isinstance(data, dict):
+                    logger.warning("⚠️  Unexpected data format in Firebase. Skipping...")
+                    data = None
+                old_users, self._users = self._users, data or {}
+                self._loaded.set()
+                # A resync reports only the users that differ
+                changed = {
+                    user_id
+                    for user_id in old_users.keys() | self._users.keys()
+                    if old_users.get(user_id) != self._users.get(user_id)
+                }
+            elif event_type == "put":
+                _set_path(self._users, parts, data)
+                changed = {parts[0]}
+            elif event_type == "patch":
+                changed = set()
+                for key, value in (data or {}).items():
+                    key_parts = parts + key.strip("/").split("/")
+                    _set_path(self._users, key_parts, value)
+                    changed.add(key_parts[0])
+            else:
+                return
+            updates = [
+                (user_id, dict(user) if isinstance(user, dict) else None)
+                for user_id in changed
+                for user in [self._users.get(user_id)]
+            ]
+
+        for callback in self._subscribers:
+            for user_id, user in updates:
+                try:
+                    callback(user_id, user)
+                except Exception as e:
+                    logger.error(f"💥 Users subscriber failed for {user_id}: {e}")
+
+    def loaded(self) -> bool:
+        return self._loaded.is_set()
+
+    def _ready(self) -> bool:
+        if self._watchdog is None:
+            self.start()
+        return self._loaded.is_set()
+
+    def users(self) -> dict:
+        """
+        Returns:
+            A copy of every user, as `{user_id: fields}`.
+        """
+        if not self._ready():
+            users = db.reference(self.path).get()
+            return users if isinstance(users, dict) else {}
+
+        with self._lock:
+            return {
+                user_id: dict(data) if isinstance(data, dict) else data
+                for user_id, data in self._users.items()
+            }
+
+    def get(self, user_id: str):
+        """
+        Returns:
+            A copy of the user's fields, or None if there is no such user.
+        """
+        if not self._ready():
+            return db.reference(f"{self.path}/{user_id}").get()
+
+        with self._lock:
+            data = self._users.get(str(user_id))
+            return dict(data) if isinstance(data, dict) else data
+
+    def exists(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def count(self) -> int:
+        if not self._ready():
+            return len(self.users())
+
+        with self._lock:
+            return len(self._users)
+
+
+user_store = UserStore()
+
+
+class WriteBatcher:
+    """
+    Collects writes and sends those of each tick as a single root-level
+    multi-path update instead of one request per write. Writes that nest
+    are merged, since Firebase rejects an update where one path lies
+    below another.
+    """
+
+    def __init__(
+        self,
+        tick: float = WRITE_TICK,
+        max_paths: int = WRITE_BATCH_PATHS,
+        retries: int = WRITE_RETRIES,
+    ):
+        self.tick = tick
+        self.max_paths = max_paths
+        self.retries = retries
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+        self._writes = 0
+        self._round_trips = 0
+        self._dropped = 0
+
+    def set(self, path: str, value):
+        """Queue setting `path`, from the database root, to `value`; None deletes."""
+        parts = [part for part in path.split("/") if part]
+        key = "/".join(parts)
+        with self._cond:
+            # A write replaces the queued writes below it...
+            for queued in [queued for queued in self._pending if queued.startswith(key + "/")]:
+                del self._pending[queued]
+
+            # ...and goes into a queued write above it
+            for depth in range(1, len(parts)):
+                ancestor = "/".join(parts[:depth])
+                if ancestor in self._pending:
+                    node = self._pending[ancestor]
+                    node = copy.deepcopy(node) if isinstance(node, dict) else {}
+                    _set_path(node, parts[depth:], value)
+                    self._pending[ancestor] = node or None
+                    break
+            else:
+                self._pending[key] = value
+
+            self._writes += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            if len(self._pending) == 1 or len(self._pending) >= self.max_paths:
+                self._cond.notify()
+
+    def delete(self, path: str):
+        self.set(path, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "writes": self._writes,
+                "round_trips": self._round_trips,
+                "saved": self._writes - self._round_trips - self._dropped - len(self._pending),
+                "pending": len(self._pending),
+                "dropped": self._dropped,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+
+                # Gather what else comes in during this tick
+                deadline = time.monotonic() + self.tick
+                while not self._closing and len(self._pending) < self.max_paths:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            self.flush()
+
+    def flush(self):
+        # One flush at a time, so batches reach Firebase in order
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            paths = list(pending)
+            for i in range(0, len(paths), self.max_paths):
+                batch = {path: pending[path] for path in paths[i : i + self.max_paths]}
+                self._send(batch)
+
+            stats = self.stats()
+            logger.info(
+                f"💾 Flushed {len(paths)} writes, {stats['saved']} round-trips saved so far."
+            )
+
+    def _send(self, batch: dict):
+        for attempt in range(self.retries + 1):
+            try:
+                db.reference("/").update(batch)
+                with self._cond:
+                    self._round_trips += 1
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    break
+                logger.warning(f"⚠️  Batched write failed ({e}), retrying...")
+                time.sleep(WRITE_RETRY_DELAY * 2**attempt)
+
+        logger.error(f"💥 Dropped {len(batch)} batched writes: {', '.join(batch)}")
+        with self._cond:
+            self._dropped += len(batch)
+        # The mirror already shows these writes; reload it from Firebase
+        user_store.resync()
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+write_batcher = WriteBatcher()
+
 
 # Add new user
 def add_new_user(user_id: str):
@@ -31,23 +455,27 @@ def add_new_user(user_id: str):
     end_ist = now_ist + timedelta(days=30)
 
     # Convert to string
-    start_date_str = now_ist.strftime("%d-%m-%Y %I:%M:%S %p")
-    end_date_str = end_ist.strftime("%d-%m-%Y %I:%M:%S %p")
-
-    # Firebase reference
-    user_ref = db.reference(f"users/{user_id}")
+    start_date_str = now_ist.strftime(DATE_FORMAT)
+    end_date_str = end_ist.strftime(DATE_FORMAT)
 
     # Prevent overwrite
-    if user_ref.get() is not None:
+    if user_store.exists(user_id):
         logger.warning(
             f"⚠️  User {user_id} already exists. Skipping add to avoid overwrite."
         )
         return
 
     # Set user data
-    user_ref.set(
-        {"start_date": start_date_str, "end_date": end_date_str, "extra_days": 0}
-    )
+    user_data = {
+        "start_date": start_date_str,
+        "end_date": end_date_str,
+        "end_ts": int(end_ist.timestamp()),
+        "extra_days": 0,
+    }
+    # Batched like removals, so a rejoin replaces a removal still queued
+    # instead of being deleted by it
+    write_batcher.set(f"users/{user_id}", user_data)
+    user_store.apply("put", f"/{user_id}", user_data)
 
     logger.info(
         f"✅ User {user_id} added with premium access from {start_date_str} to {end_date_str}"
@@ -56,8 +484,7 @@ def add_new_user(user_id: str):
 
 # Add 7 days extra
 def add_extra_7_days(user_id: str):
-    user_ref = db.reference(f"users/{user_id}")
-    user_data = user_ref.get()
+    user_data = user_store.get(user_id)
 
     if not user_data:
         logger.warning(f"❌ Cannot add extra days. User {user_id} not found.")
@@ -68,18 +495,19 @@ def add_extra_7_days(user_id: str):
         logger.warning(f"❌ Unexpected data type for user {user_id}: {type(user_data)}")
         return False
 
-    # Parse end_date
-    current_end = datetime.strptime(user_data["end_date"], "%d-%m-%Y %I:%M:%S %p")
-    current_end = india.localize(current_end)
-
     # Add 7 days
-    new_end = current_end + timedelta(days=7)
-    new_end_str = new_end.strftime("%d-%m-%Y %I:%M:%S %p")
-
-    # Update firebase
-    user_ref.update(
-        {"end_date": new_end_str, "extra_days": user_data.get("extra_days", 0) + 7}
-    )
+    new_end_ts = end_timestamp(user_data) + 7 * DAY
+    new_end_str = format_timestamp(new_end_ts)
+
+    changes = {
+        "end_date": new_end_str,
+        "end_ts": new_end_ts,
+        "extra_days": user_data.get("extra_days", 0) + 7,
+    }
+    # Queued behind the user's own record, should that still be pending
+    for field, value in changes.items():
+        write_batcher.set(f"users/{user_id}/{field}", value)
+    user_store.apply("patch", f"/{user_id}", changes)
 
     logger.info(
         f"➕  Added 7 extra days to user {user_id}. New end date: {new_end_str}"
@@ -87,139 +515,220 @@ def add_extra_7_days(user_id: str):
     return True
 
 
-def remove_user(user_id: str):
-    removal_queue_ref = db.reference(f"removal_queue")
+def remove_user(user_id: str) -> int:
+    """
+    Queue a user for removal after the grace period.
 
+    Returns:
+        When the removal is due, in epoch seconds.
+    """
     now = datetime.now(india)
-    timestamp_str = now.strftime("%d-%m-%Y %I:%M:%S %p")
+    timestamp_str = now.strftime(DATE_FORMAT)
 
     # Add to queue instead of deleting immediately
-    removal_queue_ref.child(str(user_id)).set({"timestamp": timestamp_str})
+    write_batcher.set(f"removal_queue/{user_id}", {"timestamp": timestamp_str})
 
     logger.info(f"🕒 Queued user {user_id} for removal after 24 hours.")
+    return int(now.timestamp()) + REMOVAL_GRACE
 
 
-def process_removal_queue():
-    while True:
-        try:
-            removal_queue_ref = db.reference("removal_queue")
-            all_items = removal_queue_ref.get() or {}
-
-            if not all_items:
-                time.sleep(30)
-                continue
-
-            if not isinstance(all_items, dict):
-                logger.warning("⚠️  Unexpected removal queue format.")
-                time.sleep(30)
-                continue
+def removal_deadlines() -> Dict[str, int]:
+    """
+    Returns:
+        When each queued removal is due, in epoch seconds, by user ID.
+    """
+    all_items = db.reference("removal_queue").get() or {}
+    if not isinstance(all_items, dict):
+        logger.warning("⚠️  Unexpected removal queue format.")
+        return {}
 
-            now = datetime.now(india)
-
-            for user_id, item in all_items.items():
-                timestamp_str = item.get("timestamp")
-
-                if not user_id or not timestamp_str:
-                    continue
-
-                try:
-                    removal_time = datetime.strptime(
-                        timestamp_str, "%d-%m-%Y %I:%M:%S %p"
-                    )
-                    removal_time = india.localize(removal_time)
-
-                except Exception as e:
-                    logger.error(f"Timestamp parsing error: {e}")
-                    continue
-
-                if now >= removal_time + timedelta(
-                    hours=24
-                ):  # For testing use minutes=1
-                    logger.info(
-                        f"⏳ For user: {user_id}. Now: {now.strftime('%Y-%m-%d %H:%M:%S')}"
-                    )
-                    logger.info(
-                        f"Scheduled (Added to removal queue): {removal_time.strftime('%Y-%m-%d %H:%M:%S')}"
-                    )
-                    logger.info(
-                        f"Deadline: {(removal_time + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')}"
-                    )
-
-                    db.reference(f"users/{user_id}").delete()
-                    logger.info(f"✅ Removed user {user_id} after 24 hours grace.")
-                    removal_queue_ref.child(user_id).delete()
-                else:
-                    logger.info(
-                        f"✅ Ready to delete {user_id}. Now: {now.strftime('%Y-%m-%d %H:%M:%S')}, "
-                        f"Removal time: {removal_time.strftime('%Y-%m-%d %H:%M:%S')}"
-                    )
+    deadlines = {}
+    for user_id, item in all_items.items():
+        timestamp_str = item.get("timestamp") if isinstance(item, dict) else None
+        if not user_id or not timestamp_str:
+            continue
 
+        try:
+            removal_time = india.localize(datetime.strptime(timestamp_str, DATE_FORMAT))
         except Exception as e:
-            logger.error(f"💥 Error processing removal queue: {e}")
+            logger.error(f"Timestamp parsing error: {e}")
+            continue
 
-        time.sleep(30)
+        deadlines[user_id] = int(removal_time.timestamp()) + REMOVAL_GRACE
+    return deadlines
 
 
-def get_expiring_users():  # For testing pass test_mode=False as parameter
-    users_ref = db.reference("users")
-    all_users = users_ref.get()
-    expiring_users = {"soon": [], "expired": []}
+def complete_removal(user_id: str):
+    write_batcher.delete(f"users/{user_id}")
+    write_batcher.delete(f"removal_queue/{user_id}")
+    user_store.apply("put", f"/{user_id}", None)
+    logger.info(f"✅ Removed user {user_id} after 24 hours grace.")
 
-    if all_users is None:
-        logger.info("✅ Firebase Telegram Payment DB is empty.")
-        return
-    elif not isinstance(all_users, dict):
-        logger.warning("⚠️  Unexpected data format in Firebase. Skipping...")
-        return
 
-    # if test_mode:
-    #     now = datetime.strptime("23-05-2025 10:35:00 AM", "%d-%m-%Y %I:%M:%S %p")
-    #     now = india.localize(now)
-    # else:
-    now = datetime.now(india)
+def next_notice(data: dict, now: float) -> Optional[Tuple[int, str]]:
+    """
+    The next plan notice a user is due: "soon", REMINDER_DAYS before the
+    plan ends, then "expired" when it ends.
 
-    for user_id, data in all_users.items():
-        if not isinstance(data, dict):
-            return
+    Returns:
+        When the notice is due, in epoch seconds, and its kind, or None
+        once both were sent.
+    """
+    end_ts = end_timestamp(data)
+    if end_ts is None:
+        return None
 
-        try:
-            end_date = datetime.strptime(data["end_date"], "%d-%m-%Y %I:%M:%S %p")
-            end_date = india.localize(end_date)
-            days_left = (end_date - now).days
+    notified = data.get("notified", "")
+    reminder_at = end_ts - REMINDER_DAYS * DAY
+    # A reminder missed by a day or more, while the bot was down, is
+    # skipped: it would no longer say the right number of days
+    if notified not in ("soon", "expired") and now < reminder_at + DAY:
+        return reminder_at, "soon"
+    if notified != "expired":
+        return end_ts, "expired"
+    return None
 
-            already_notified = data.get("notified", "")
 
-            if days_left == 7 and already_notified != "soon":
-                expiring_users["soon"].append((user_id, data["end_date"]))
-                users_ref.child(user_id).update({"notified": "soon"})
+def expiring_users(until: float) -> dict:
+    """
+    Users whose plan ends by `until`, in epoch seconds, straight from
+    Firebase through the `end_ts` index (see database.rules.json), for use
+    before the users mirror is loaded. Users without `end_ts` yet sort
+    first and are always included.
 
-            elif days_left <= 0 and already_notified != "expired":
-                expiring_users["expired"].append((user_id, data["end_date"]))
-                users_ref.child(user_id).update({"notified": "expired"})
+    Returns:
+        `{user_id: fields}`
+    """
+    users = db.reference("users").order_by_child("end_ts").end_at(int(until)).get()
+    return dict(users) if isinstance(users, dict) else {}
 
-        except Exception as e:
-            logger.error(f"🔥 Error checking user {user_id}: {e}")
 
-    return expiring_users
+def mark_notified(user_id: str, kind: str):
+    write_batcher.set(f"users/{user_id}/notified", kind)
+    user_store.apply("patch", f"/{user_id}", {"notified": kind})
 
 
 def get_stats():
-    users_ref = db.reference("users")
-    all_users = users_ref.get()
+    total_user = user_store.count()
 
-    if not all_users:
+    if not total_user:
         logger.info("No users found in the database.")
         return 0, 0  # return both user count and amount as 0
 
-    total_user = len(all_users)
     total_amount = total_user * 40
 
     logger.info(f"📊 Total active users: {total_user}, Total amount: {total_amount}")
     return total_user, total_amount
 
 
+_executor = ThreadPoolExecutor(max_workers=FIREBASE_WORKERS, thread_name_prefix="firebase")
+
+# Reads in flight, shared by every caller asking for the same path. Kept
+# per event loop: webhook updates are handled on a loop per request, and
+# an asyncio future can only be awaited on the loop it belongs to.
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Future]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def _call(function: Callable, *args, timeout: float = FIREBASE_TIMEOUT) -> Any:
+    future = _executor.submit(function, *args)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # Frees the worker if the call never started; one already talking
+        # to Firebase runs to its end
+        future.cancel()
+        raise
+
+
+async def _write(function: Callable, *args, timeout: float = FIREBASE_TIMEOUT) -> Any:
+    """
+    `_call` for writes, which are not safe to repeat: the caller stops
+    waiting after `timeout` seconds or when cancelled, but the write is
+    never cancelled. A timeout therefore means the write is still pending,
+    not that it failed.
+    """
+    write = asyncio.shield(asyncio.wrap_future(_executor.submit(function, *args)))
+    try:
+        return await asyncio.wait_for(write, timeout)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"⌛ {function.__name__}({', '.join(map(repr, args))}) still running "
+            f"after {timeout}s, left to finish"
+        )
+        raise
+
+
+async def _read(key: Hashable, function: Callable, *args) -> Any:
+    """
+    `_call` for reads: while a read of `key` is running, later callers
+    wait for its result instead of starting their own. Each caller gets
+    its own copy, and cancelling one caller does not cancel the read.
+    """
+    inflight = _inflight.setdefault(asyncio.get_running_loop(), {})
+    shared = inflight.get(key)
+    if shared is None:
+        shared = asyncio.ensure_future(_call(function, *args))
+        inflight[key] = shared
+        shared.add_done_callback(
+            lambda done: inflight.pop(key) if inflight.get(key) is done else None
+        )
+    return copy.deepcopy(await asyncio.shield(shared))
+
+
+async def add_new_user_async(user_id: str):
+    await _write(add_new_user, user_id)
+
+
+async def add_extra_7_days_async(user_id: str) -> bool:
+    return await _write(add_extra_7_days, user_id)
+
+
+async def remove_user_async(user_id: str) -> int:
+    return await _write(remove_user, user_id)
+
+
+async def complete_removal_async(user_id: str):
+    await _write(complete_removal, user_id)
+
+
+async def mark_notified_async(user_id: str, kind: str):
+    await _write(mark_notified, user_id, kind)
+
+
+async def removal_deadlines_async() -> Dict[str, int]:
+    return await _read("removal_queue", removal_deadlines)
+
+
+async def get_user_async(user_id: str) -> Optional[dict]:
+    return await _read(f"users/{user_id}", user_store.get, user_id)
+
+
+async def get_users_async() -> dict:
+    return await _read("users", user_store.users)
+
+
+async def expiring_users_async(until: float) -> dict:
+    return await _call(expiring_users, until)
+
+
+async def get_stats_async() -> Tuple[int, int]:
+    return await _read("stats", get_stats)
+
+
+async def start_user_store_async():
+    # Waits for the first snapshot, which may take longer than a call
+    await _call(user_store.start, timeout=USERS_LOAD_TIMEOUT + FIREBASE_TIMEOUT)
+
+
+async def close_async():
+    """Send the queued writes and stop the listener."""
+    await _call(write_batcher.close, timeout=None)
+    await _call(user_store.close, timeout=None)
+
+
 # add_new_user("123456789")
 # add_extra_7_days("123456789")
 # remove_user("123456789")
-# get_expiring_users()
 # get_stats()
@@ -1,10 +1,29 @@
 import os
-import re
 import json
+import argparse
+import time
 import asyncio
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Callable,
+    Collection,
+    DefaultDict,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 from dotenv import load_dotenv
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
+from normalizer import normalize_title
+from metadata import METADATA_VERSION, TitleMetadata, extract, extract_parallel
+from search_index import shard_files
 
 load_dotenv()
 
@@ -14,104 +33,1439 @@ API_HASH = os.getenv("TELEGRAM_API_HASH", "None")
 SESSION_NAME = "my_session2"
 CHANNEL_NAME = "sfudjodgpehjghlalbkldoijkoska"
 
+# Source channels to index, comma separated usernames or chat IDs
+INDEX_CHANNELS = [
+    channel.strip()
+    for channel in os.getenv("INDEX_CHANNELS", CHANNEL_NAME).split(",")
+    if channel.strip()
+]
+
 DB_FILE = "index.db"
 LAST_INDEXED_FILE = "last_indexed.json"
 
-QUALITY_PATTERN = re.compile(r"(\d{3,4}p|HDRip|WEB-DL|PreDVD)", re.IGNORECASE)
-EPISODE_PATTERN = re.compile(r"(S\d+E\d+|EP?\s?\d+|Episode\s+\d+)", re.IGNORECASE)
+# Optional sharding of the index into one SQLite file per source channel
+# ("channel") or per first letter of the title ("initial"). DB_FILE then
+# only keeps the checkpoints.
+SHARD_BY = os.getenv("INDEX_SHARD_BY", "")
+SHARD_DIR = os.getenv("INDEX_SHARD_DIR", "index_shards")
+SHARD_MODES = ("channel", "initial")
+
+# Chat ID stored for files indexed before the source channel was recorded.
+# They all come from CHANNEL_NAME, the bot's DATABASE_ID channel.
+LEGACY_CHAT_ID = 0
+
+# Messages written per transaction while scanning a channel
+BATCH_SIZE = 500
+# Channels streamed at the same time, and batches allowed to wait for the writer
+MAX_CONCURRENT_SCANS = 4
+WRITE_QUEUE_SIZE = 8
+# Seconds live channel updates are collected before they are written together
+LIVE_FLUSH_DELAY = 2.0
+WRITER_CACHE_KIB = 64 * 1024
+
+
+# One row per indexed file. The full-text indexes below read their text
+# from here, so titles are stored once and everything else is typed.
+MEDIA_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS media (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel INTEGER NOT NULL DEFAULT 0,
+        message_id INTEGER NOT NULL,
+        base_title TEXT NOT NULL,
+        original_title TEXT NOT NULL,
+        description TEXT NOT NULL DEFAULT '',
+        search_key TEXT NOT NULL,
+        quality TEXT NOT NULL DEFAULT '',
+        size INTEGER,
+        duration INTEGER,
+        season INTEGER,
+        episode INTEGER,
+        year INTEGER,
+        date INTEGER,
+        document_id INTEGER,
+        mime_type TEXT,
+        resolution INTEGER,
+        codec TEXT,
+        languages TEXT NOT NULL DEFAULT '',
+        episode_end INTEGER,
+        part INTEGER
+    )
+"""
+
+# Columns added to `media` after it was introduced, with their definitions
+MEDIA_ADDED_COLUMNS = {
+    "resolution": "INTEGER",
+    "codec": "TEXT",
+    "languages": "TEXT NOT NULL DEFAULT ''",
+    "episode_end": "INTEGER",
+    "part": "INTEGER",
+}
+
+# Columns filled from the file name by `metadata.extract`, in its field order
+METADATA_COLUMNS = [
+    "base_title",
+    "search_key",
+    "quality",
+    "resolution",
+    "codec",
+    "languages",
+    "year",
+    "season",
+    "episode",
+    "episode_end",
+    "part",
+]
+
+MEDIA_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS media_message ON media (channel, message_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS media_document ON media (document_id)",
+    # Re-uploads of a release have the same search key and size
+    "CREATE INDEX IF NOT EXISTS media_search_key_size ON media (search_key, size)",
+    "CREATE INDEX IF NOT EXISTS media_year ON media (year)",
+    "CREATE INDEX IF NOT EXISTS media_season ON media (season)",
+    "CREATE INDEX IF NOT EXISTS media_quality ON media (quality)",
+    "CREATE INDEX IF NOT EXISTS media_date ON media (date)",
+]
+
+# External-content indexes over `media`: ranked title search, and trigrams
+# of search keys for the typo-tolerant fallback
+MEDIA_FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+        base_title,
+        original_title,
+        description,
+        search_key,
+        content = 'media',
+        content_rowid = 'id'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS title_trigrams USING fts5(
+        search_key,
+        content = 'media',
+        content_rowid = 'id',
+        tokenize = 'trigram'
+    )
+    """,
+]
+
+# Keep both indexes in step with `media`. Updates of non-text columns such
+# as `channel` leave them alone.
+MEDIA_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS media_insert AFTER INSERT ON media BEGIN
+        INSERT INTO media_fts (rowid, base_title, original_title, description, search_key)
+        VALUES (new.id, new.base_title, new.original_title, new.description, new.search_key);
+        INSERT INTO title_trigrams (rowid, search_key) VALUES (new.id, new.search_key);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS media_delete AFTER DELETE ON media BEGIN
+        INSERT INTO media_fts (media_fts, rowid, base_title, original_title, description, search_key)
+        VALUES ('delete', old.id, old.base_title, old.original_title, old.description, old.search_key);
+        INSERT INTO title_trigrams (title_trigrams, rowid, search_key)
+        VALUES ('delete', old.id, old.search_key);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS media_update
+    AFTER UPDATE OF base_title, original_title, description, search_key ON media BEGIN
+        INSERT INTO media_fts (media_fts, rowid, base_title, original_title, description, search_key)
+        VALUES ('delete', old.id, old.base_title, old.original_title, old.description, old.search_key);
+        INSERT INTO title_trigrams (title_trigrams, rowid, search_key)
+        VALUES ('delete', old.id, old.search_key);
+        INSERT INTO media_fts (rowid, base_title, original_title, description, search_key)
+        VALUES (new.id, new.base_title, new.original_title, new.description, new.search_key);
+        INSERT INTO title_trigrams (rowid, search_key) VALUES (new.id, new.search_key);
+    END
+    """,
+]
+
+# IDs of rows deleted or updated in place since the last export, each with
+# the sequence number of its latest change; new rows are found by ID alone
+# since IDs only grow. See export.py.
+#
+# Nothing is logged until the first export turns the log on (the
+# CHANGE_LOG_KEY row of `index_meta`), and each export removes the
+# entries it covered. A row changed again only moves its entry, so bulk
+# updates such as `reextract_metadata` never log more entries than there
+# are rows.
+CHANGE_LOG_KEY = "export_change_log"
+
+MEDIA_CHANGES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS media_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id INTEGER NOT NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS media_changes_id ON media_changes (id)",
+]
+
+MEDIA_CHANGES_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS media_log_delete AFTER DELETE ON media
+    WHEN EXISTS (SELECT 1 FROM index_meta WHERE key = '{CHANGE_LOG_KEY}') BEGIN
+        DELETE FROM media_changes WHERE id = old.id;
+        INSERT INTO media_changes (id) VALUES (old.id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS media_log_update AFTER UPDATE ON media
+    WHEN EXISTS (SELECT 1 FROM index_meta WHERE key = '{CHANGE_LOG_KEY}') BEGIN
+        DELETE FROM media_changes WHERE id = new.id;
+        INSERT INTO media_changes (id) VALUES (new.id);
+    END
+    """,
+]
+
+# Change log triggers that logged every change, replaced by the ones above
+LEGACY_TRIGGERS = ["media_change_delete", "media_change_update"]
+
+MEDIA_COLUMNS = [
+    "id",
+    "channel",
+    "message_id",
+    "base_title",
+    "original_title",
+    "description",
+    "search_key",
+    "quality",
+    "size",
+    "duration",
+    "season",
+    "episode",
+    "year",
+    "date",
+    "document_id",
+    "mime_type",
+    "resolution",
+    "codec",
+    "languages",
+    "episode_end",
+    "part",
+]
+
+# Inserts a JSON array of rows in MEDIA_COLUMNS order
+MEDIA_INSERT_SQL = f"""
+    INSERT INTO media ({", ".join(MEDIA_COLUMNS)})
+    SELECT {", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(MEDIA_COLUMNS)))}
+    FROM json_each(?)
+"""
+
+# A duplicate keeps what indexing it needs, so it can take the place of its
+# original when that is deleted
+DUPLICATE_COLUMNS = [
+    "channel",
+    "message_id",
+    "kind",
+    "original_id",
+    "title",
+    "size",
+    "detected_at",
+    "description",
+    "document_id",
+    "mime_type",
+    "duration",
+    "date",
+]
+
+# Columns added to `duplicate_files` after it was introduced
+DUPLICATE_ADDED_COLUMNS = {
+    "description": "TEXT NOT NULL DEFAULT ''",
+    "document_id": "INTEGER",
+    "mime_type": "TEXT",
+    "duration": "INTEGER",
+    "date": "INTEGER",
+}
+
+DUPLICATE_INSERT_SQL = f"""
+    INSERT INTO duplicate_files ({", ".join(DUPLICATE_COLUMNS)})
+    VALUES ({", ".join("?" * len(DUPLICATE_COLUMNS))})
+"""
+
+# Tables of the layout before `media`, converted by `migrate_to_media`
+LEGACY_TABLES = ["files", "file_meta", "file_documents", "title_trigrams"]
+
+
+# Classes of an incoming file, see `classify_file`
+FILE_NEW = "new"
+DUPLICATE_EXACT = "exact"
+DUPLICATE_LIKELY = "likely"
+
+
+class FileEntry(NamedTuple):
+    title: str
+    description: str
+    message_id: int
+    # Telegram document details, when known, used to spot duplicates
+    document_id: Optional[int] = None
+    size: Optional[int] = None
+    mime_type: Optional[str] = None
+    duration: Optional[int] = None
+    date: Optional[int] = None  # Unix time the message was posted
+
+
+class BatchResult(NamedTuple):
+    indexed: int
+    duplicates: int  # Files recorded as duplicates instead of being indexed
 
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
+def table_columns(cursor: sqlite3.Cursor, table: str) -> list:
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+
+def file_size(path: str) -> int:
+    # Committed pages may still sit in the WAL file
+    return sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal")
+        if os.path.exists(path + suffix)
+    )
+
+
+def table_exists(cursor: sqlite3.Cursor, table: str) -> bool:
+    return (
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ? AND type = 'table'", (table,)
+        ).fetchone()
+        is not None
+    )
+
+
+def migrate_to_media(cursor: sqlite3.Cursor) -> int:
+    """
+    Move an index from the `files` full-text table (with its `file_meta`
+    and `file_documents` side tables, where present) into `media`, keeping
+    row IDs so recorded duplicates still point at their originals.
+
+    Values missing from older layouts are derived from the titles again.
+
+    Returns:
+        int: Number of files moved
+    """
+    files_columns = table_columns(cursor, "files")
+    rows = cursor.execute(
+        f"""
+            SELECT rowid, base_title, original_title, description, quality, message_id,
+                {"search_key" if "search_key" in files_columns else "NULL"}
+            FROM files
+        """
+    ).fetchall()
+
+    channels = {}
+    if "channel" in table_columns(cursor, "file_meta"):
+        channels = dict(cursor.execute("SELECT id, channel FROM file_meta"))
+    documents = {}
+    if table_exists(cursor, "file_documents"):
+        documents = {
+            row[0]: row[1:]
+            for row in cursor.execute(
+                "SELECT id, document_id, size, mime_type, duration FROM file_documents"
+            )
+        }
+
+    media = []
+    for rowid, base_title, title, description, quality, message_id, search_key in rows:
+        meta = extract(title)
+        document_id, size, mime_type, duration = documents.get(rowid, (None,) * 4)
+        media.append(
+            (
+                rowid,
+                channels.get(rowid, LEGACY_CHAT_ID),
+                message_id,
+                base_title,
+                title,
+                description or "",
+                search_key if search_key is not None else meta.search_key,
+                quality or "",
+                size,
+                duration,
+                meta.season,
+                meta.episode,
+                meta.year,
+                None,
+                document_id,
+                mime_type,
+                meta.resolution,
+                meta.codec,
+                meta.languages,
+                meta.episode_end,
+                meta.part,
+            )
+        )
+
+    for table in LEGACY_TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    create_media_schema(cursor, with_triggers=False)
+
+    # Same message indexed twice by an old add_to_index race: keep the newest
+    cursor.executemany(
+        f"""
+            INSERT OR REPLACE INTO media ({", ".join(MEDIA_COLUMNS)})
+            VALUES ({", ".join("?" * len(MEDIA_COLUMNS))})
+        """,
+        media,
+    )
+    # Fill both indexes in bulk, then let the triggers take over
+    cursor.execute("INSERT INTO media_fts (media_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO title_trigrams (title_trigrams) VALUES ('rebuild')")
+    create_media_schema(cursor)
+    return len(media)
+
+
+def create_media_schema(cursor: sqlite3.Cursor, with_triggers: bool = True):
+    cursor.execute(MEDIA_SCHEMA)
+    has_unique_log = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'media_changes_id'"
+    ).fetchone()
+    if table_exists(cursor, "media_changes") and not has_unique_log:
+        # Logs from before entries were unique keep the latest one per row
+        cursor.execute(
+            "DELETE FROM media_changes WHERE seq NOT IN (SELECT max(seq) FROM media_changes GROUP BY id)"
+        )
+    for trigger in LEGACY_TRIGGERS:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for statement in MEDIA_INDEXES + MEDIA_FTS_SCHEMA + MEDIA_CHANGES_SCHEMA:
+        cursor.execute(statement)
+    if with_triggers:
+        for statement in MEDIA_TRIGGERS + MEDIA_CHANGES_TRIGGERS:
+            cursor.execute(statement)
+
+
+def init_db(db_file: str = DB_FILE, seed: bool = True):
+    conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
+
+    migrated = table_exists(cursor, "files")
+    if migrated:
+        moved = migrate_to_media(cursor)
+        print(f"Moved {moved} indexed files to the media table")
+    create_media_schema(cursor)
+
+    columns = table_columns(cursor, "media")
+    added = [column for column in MEDIA_ADDED_COLUMNS if column not in columns]
+    for column in added:
+        cursor.execute(f"ALTER TABLE media ADD COLUMN {column} {MEDIA_ADDED_COLUMNS[column]}")
+
+    # Messages left out of the index because they repeat an indexed file
     cursor.execute(
         """
-        CREATE VIRTUAL TABLE IF NOT EXISTS files USING fts5(
-            base_title,
-            original_title,
-            description,
-            quality,
-            message_id UNINDEXED
+        CREATE TABLE IF NOT EXISTS duplicate_files (
+            channel INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            original_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            size INTEGER,
+            detected_at INTEGER NOT NULL,
+            description TEXT NOT NULL DEFAULT '',
+            document_id INTEGER,
+            mime_type TEXT,
+            duration INTEGER,
+            date INTEGER,
+            PRIMARY KEY (channel, message_id)
         )
         """
     )
+    columns = table_columns(cursor, "duplicate_files")
+    for column, definition in DUPLICATE_ADDED_COLUMNS.items():
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE duplicate_files ADD COLUMN {column} {definition}")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS duplicate_original ON duplicate_files (original_id)"
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS index_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
+    cursor.execute(
+        "INSERT OR IGNORE INTO index_meta (key, value) VALUES ('generation', 0)"
+    )
+    # Rules the stored metadata was extracted with; rows from before the
+    # extra columns existed are behind any version
+    has_rows = cursor.execute("SELECT 1 FROM media LIMIT 1").fetchone() is not None
+    cursor.execute(
+        "INSERT OR IGNORE INTO index_meta (key, value) VALUES ('metadata_version', ?)",
+        (0 if added and has_rows and not migrated else METADATA_VERSION,),
+    )
+    version = cursor.execute(
+        "SELECT value FROM index_meta WHERE key = 'metadata_version'"
+    ).fetchone()[0]
+    if version < METADATA_VERSION:
+        print(
+            f"⚠️ Metadata was extracted with older rules (v{version} < v{METADATA_VERSION}), "
+            "run with --reextract to update it"
+        )
+    # Last indexed message of each source channel, written in the same
+    # transaction as the rows it covers
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS index_checkpoints (
+            channel TEXT PRIMARY KEY,
+            last_message_id INTEGER NOT NULL
+        )
+        """
+    )
+    if seed:
+        seed_checkpoint(cursor)
+    # Schema changes above may have rewritten rows readers have cached
+    bump_generation(cursor)
     conn.commit()
     conn.close()
 
 
-def extract_metadata(title: str) -> str:
-    base_title = QUALITY_PATTERN.sub("", title)
-    base_title = re.sub(r"\s+", " ", base_title).strip()
-    base_title = re.sub(r"[-\s]+$", "", base_title)
-    return base_title
+def bump_generation(cursor: sqlite3.Cursor):
+    # Readers compare this counter to decide whether cached results are stale
+    cursor.execute(
+        """
+            INSERT INTO index_meta (key, value) VALUES ('generation', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1
+        """
+    )
+
+
+def open_writer(db_file: str = DB_FILE) -> sqlite3.Connection:
+    """
+    Connection tuned for bulk loads.
+
+    WAL lets the bot keep searching while batches are written, and with
+    synchronous=NORMAL a commit only appends to the log instead of waiting
+    for the whole database file to be flushed.
+    """
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute(f"PRAGMA cache_size = -{WRITER_CACHE_KIB}")
+    return conn
+
+
+def classify_file(
+    cursor: sqlite3.Cursor, search_key: str, document_id: Optional[int], size: Optional[int]
+) -> Tuple[str, Optional[int]]:
+    """
+    Tell whether a file is already indexed, with one index lookup each for
+    the document and the (title, size) pair.
+
+    Returns:
+        Tuple: FILE_NEW, DUPLICATE_EXACT for the same Telegram document or
+            DUPLICATE_LIKELY for the same normalized title and size, and the
+            rowid of the indexed copy
+    """
+    if document_id is not None:
+        row = cursor.execute(
+            "SELECT id FROM media WHERE document_id = ?", (document_id,)
+        ).fetchone()
+        if row:
+            return DUPLICATE_EXACT, row[0]
+    if size:
+        row = cursor.execute(
+            "SELECT id FROM media WHERE search_key = ? AND size = ? LIMIT 1",
+            (search_key, size),
+        ).fetchone()
+        if row:
+            return DUPLICATE_LIKELY, row[0]
+    return FILE_NEW, None
+
+
+def media_row(rowid: Optional[int], chat_id: int, entry: FileEntry, meta: TitleMetadata) -> tuple:
+    # A `media` row in MEDIA_COLUMNS order; a rowid of None lets SQLite pick
+    return (
+        rowid,
+        chat_id,
+        entry.message_id,
+        meta.base_title,
+        entry.title,
+        entry.description,
+        meta.search_key,
+        meta.quality,
+        entry.size,
+        entry.duration,
+        meta.season,
+        meta.episode,
+        meta.year,
+        entry.date,
+        entry.document_id,
+        entry.mime_type,
+        meta.resolution,
+        meta.codec,
+        meta.languages,
+        meta.episode_end,
+        meta.part,
+    )
+
+
+def promote_duplicates(cursor: sqlite3.Cursor, original_ids: List[int]) -> int:
+    """
+    Look again at the duplicates of deleted `media` rows: each one is
+    pointed at another indexed copy if there is one, and indexed in place
+    of its original otherwise.
+
+    Returns:
+        int: Number of duplicates indexed
+    """
+    if not original_ids:
+        return 0
+
+    rows = cursor.execute(
+        """
+            SELECT channel, message_id, title, description, document_id, size, mime_type,
+                duration, date
+            FROM duplicate_files
+            WHERE original_id IN (SELECT value FROM json_each(?))
+            ORDER BY channel, message_id
+        """,
+        (json.dumps(original_ids),),
+    ).fetchall()
+
+    promoted = 0
+    # One at a time, so the rest of a group find the copy indexed first
+    for chat_id, message_id, title, description, document_id, size, mime_type, duration, date in rows:
+        meta = extract(title)
+        kind, original_id = classify_file(cursor, meta.search_key, document_id, size)
+        if kind != FILE_NEW:
+            cursor.execute(
+                """
+                    UPDATE duplicate_files SET kind = ?, original_id = ?
+                    WHERE channel = ? AND message_id = ?
+                """,
+                (kind, original_id, chat_id, message_id),
+            )
+            continue
+
+        entry = FileEntry(title, description, message_id, document_id, size, mime_type, duration, date)
+        cursor.execute(MEDIA_INSERT_SQL, (json.dumps([media_row(None, chat_id, entry, meta)]),))
+        cursor.execute(
+            "DELETE FROM duplicate_files WHERE channel = ? AND message_id = ?",
+            (chat_id, message_id),
+        )
+        promoted += 1
+    return promoted
+
+
+def write_batch(
+    conn: sqlite3.Connection,
+    messages: List[Tuple],
+    chat_id: int = LEGACY_CHAT_ID,
+    source: Optional[str] = None,
+    checkpoint: Optional[int] = None,
+) -> BatchResult:
+    """
+    Index a batch of messages in one transaction, replacing any earlier
+    rows of the same messages. Files that repeat an indexed one are
+    recorded in `duplicate_files` instead.
+
+    Args:
+        conn (sqlite3.Connection): Writer connection
+        messages (list): `FileEntry` rows, or plain (title, description,
+            message_id) tuples when the document is unknown
+        chat_id (int): Channel the messages belong to
+        source (str, optional): Source channel whose checkpoint to advance
+        checkpoint (int, optional): Last message ID covered by the batch,
+            the highest ID in `messages` by default
+    """
+    # Later edits of a message in the same batch win
+    latest = {entry[2]: FileEntry(*entry) for entry in messages}
+    if checkpoint is None and latest:
+        checkpoint = max(latest)
+
+    with conn:
+        cursor = conn.cursor()
+        # Replaced messages go first; the triggers drop their index entries
+        ids = json.dumps(list(latest))
+        replaced = [
+            row[0]
+            for row in cursor.execute(
+                """
+                    DELETE FROM media
+                    WHERE channel = ? AND message_id IN (SELECT value FROM json_each(?))
+                    RETURNING id
+                """,
+                (chat_id, ids),
+            ).fetchall()
+        ]
+        cursor.execute(
+            """
+                DELETE FROM duplicate_files
+                WHERE channel = ? AND message_id IN (SELECT value FROM json_each(?))
+            """,
+            (chat_id, ids),
+        )
+
+        # IDs are never reused, so recorded duplicates and the title index's
+        # high-water mark stay valid after deletes
+        last = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'media'").fetchone()
+        rowid = last[0] if last else 0
+        media, duplicates = [], []
+        # Files of this batch, for duplicates within the batch itself
+        batch_documents, batch_sizes = {}, {}
+        now = int(time.time())
+
+        for entry in latest.values():
+            meta = extract(entry.title)
+            search_key = meta.search_key
+
+            kind, original_id = classify_file(cursor, search_key, entry.document_id, entry.size)
+            if kind == FILE_NEW and entry.document_id in batch_documents:
+                kind, original_id = DUPLICATE_EXACT, batch_documents[entry.document_id]
+            elif kind == FILE_NEW and entry.size and (search_key, entry.size) in batch_sizes:
+                kind, original_id = DUPLICATE_LIKELY, batch_sizes[(search_key, entry.size)]
+            if kind != FILE_NEW:
+                duplicates.append(
+                    (
+                        chat_id,
+                        entry.message_id,
+                        kind,
+                        original_id,
+                        entry.title,
+                        entry.size,
+                        now,
+                        entry.description,
+                        entry.document_id,
+                        entry.mime_type,
+                        entry.duration,
+                        entry.date,
+                    )
+                )
+                continue
+
+            rowid += 1
+            media.append(media_row(rowid, chat_id, entry, meta))
+            if entry.document_id is not None:
+                batch_documents[entry.document_id] = rowid
+            if entry.size:
+                batch_sizes.setdefault((search_key, entry.size), rowid)
+
+        # One statement for the whole batch: FTS5 flushes its pending terms
+        # after every statement that fires the triggers, which makes
+        # executemany several times slower here
+        cursor.execute(MEDIA_INSERT_SQL, (json.dumps(media),))
+        cursor.executemany(DUPLICATE_INSERT_SQL, duplicates)
+        # After the new rows, so duplicates of an edited file find it again
+        promote_duplicates(cursor, replaced)
+        if media or replaced:
+            bump_generation(cursor)
+        if source is not None and checkpoint is not None:
+            save_checkpoint(cursor, source, checkpoint)
+
+    return BatchResult(len(media), len(duplicates))
+
+
+def delete_messages(conn: sqlite3.Connection, chat_id: int, message_ids: List[int]) -> int:
+    """
+    Remove deleted channel messages from the index.
+
+    Returns:
+        int: Number of indexed files removed
+    """
+    with conn:
+        cursor = conn.cursor()
+        deleted = [
+            row[0]
+            for row in cursor.execute(
+                """
+                    DELETE FROM media
+                    WHERE channel = ? AND message_id IN (SELECT value FROM json_each(?))
+                    RETURNING id
+                """,
+                (chat_id, json.dumps(message_ids)),
+            ).fetchall()
+        ]
+        cursor.execute(
+            """
+                DELETE FROM duplicate_files
+                WHERE channel = ? AND message_id IN (SELECT value FROM json_each(?))
+            """,
+            (chat_id, json.dumps(message_ids)),
+        )
+        # Copies of the deleted files keep them searchable
+        promote_duplicates(cursor, deleted)
+        if deleted:
+            bump_generation(cursor)
+    return len(deleted)
+
+
+def duplicate_report(db_file: str = DB_FILE, limit: int = 10) -> Dict:
+    """
+    Duplicates found during ingestion, newest first.
+
+    Returns:
+        dict: Counts per kind and the latest `limit` duplicates as
+            (kind, channel, message_id, title, original title) rows
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        counts = dict(
+            conn.execute("SELECT kind, COUNT(*) FROM duplicate_files GROUP BY kind").fetchall()
+        )
+        recent = conn.execute(
+            """
+                SELECT duplicate_files.kind, duplicate_files.channel, duplicate_files.message_id,
+                    duplicate_files.title, media.original_title
+                FROM duplicate_files
+                LEFT JOIN media ON media.id = duplicate_files.original_id
+                ORDER BY duplicate_files.detected_at DESC, duplicate_files.message_id DESC
+                LIMIT ?
+            """,
+            (limit,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return {
+        DUPLICATE_EXACT: counts.get(DUPLICATE_EXACT, 0),
+        DUPLICATE_LIKELY: counts.get(DUPLICATE_LIKELY, 0),
+        "recent": recent,
+    }
+
+
+def print_duplicate_report(limit: int = 50):
+    report = duplicate_report(limit=limit)
+    print(
+        f"♊ {report[DUPLICATE_EXACT]} exact and {report[DUPLICATE_LIKELY]} likely duplicates"
+    )
+    for kind, channel, message_id, title, original_title in report["recent"]:
+        print(
+            f"   [{kind}] {title} (chat {channel}, ID {message_id}) ≈ "
+            f"{original_title or 'deleted'}"
+        )
+
+
+def reextract_metadata(db_file: str = DB_FILE, workers: Optional[int] = None) -> int:
+    """
+    Extract the metadata of every indexed file again with the current
+    rules, after `metadata.METADATA_VERSION` was bumped.
+
+    Titles are read in one go, extracted on a pool of `workers` processes
+    and only rows whose values changed are written back, in a single
+    statement so the full-text indexes flush once.
+
+    Returns:
+        int: Number of rows updated
+    """
+    conn = open_writer(db_file)
+    try:
+        rows = conn.execute(
+            f"SELECT id, original_title, {', '.join(METADATA_COLUMNS)} FROM media ORDER BY id"
+        ).fetchall()
+
+        started = time.perf_counter()
+        extracted = extract_parallel([row[1] for row in rows], workers)
+        elapsed = time.perf_counter() - started
+        print(f"⚙️  Extracted {len(rows)} titles in {elapsed:.1f}s")
+
+        changed = [
+            [row[0], *meta]
+            for row, meta in zip(rows, extracted)
+            if tuple(meta) != row[2:]
+        ]
+        assignments = ", ".join(
+            f"{column} = json_extract(changed.value, '$[{i}]')"
+            for i, column in enumerate(METADATA_COLUMNS, 1)
+        )
+        with conn:
+            conn.execute(
+                f"""
+                    UPDATE media SET {assignments}
+                    FROM json_each(?) AS changed
+                    WHERE media.id = json_extract(changed.value, '$[0]')
+                """,
+                (json.dumps(changed),),
+            )
+            if changed:
+                bump_generation(conn.cursor())
+            conn.execute(
+                "UPDATE index_meta SET value = ? WHERE key = 'metadata_version'",
+                (METADATA_VERSION,),
+            )
+    finally:
+        conn.close()
+
+    print(f"✅ Updated the metadata of {len(changed)} of {len(rows)} files")
+    return len(changed)
+
+
+def adopt_legacy_rows(conn: sqlite3.Connection, chat_id: int) -> int:
+    """
+    Assign files indexed before channels were recorded to `chat_id`, the
+    resolved ID of CHANNEL_NAME.
+
+    Returns:
+        int: Number of rows updated
+    """
+    with conn:
+        updated = conn.execute(
+            "UPDATE media SET channel = ? WHERE channel = ?", (chat_id, LEGACY_CHAT_ID)
+        ).rowcount
+    if updated:
+        print(f"Assigned {updated} previously indexed files to chat {chat_id}")
+    return updated
+
+
+def shard_name(shard_by: str, chat_id: int, search_key: str) -> str:
+    """
+    Shard a file belongs to: its channel, or the first letter of its
+    normalized title, with digits and other scripts in a shard each.
+    """
+    if shard_by == "channel":
+        return f"channel_{chat_id}"
+    initial = search_key[:1]
+    if "a" <= initial <= "z":
+        return f"initial_{initial}"
+    return "initial_digit" if initial.isdigit() else "initial_other"
+
+
+def shard_path(name: str, shard_dir: str = SHARD_DIR) -> str:
+    return os.path.join(shard_dir, f"{name}.db")
+
+
+class IndexWriter:
+    """
+    Writes to the index, or to its shards when `shard_by` is set.
+
+    Without sharding every batch is one transaction on DB_FILE together
+    with its checkpoint, as before. With sharding each shard a batch
+    touches commits on its own and the checkpoint is saved in DB_FILE
+    last, so a crash in between only means the batch is written again.
+    Shard files are created on first use. Given `only`, files of any other
+    shard are skipped, which is how single shards are rebuilt.
+
+    Like the connections it holds, a writer must stay on one thread.
+    """
+
+    def __init__(
+        self,
+        db_file: str = DB_FILE,
+        shard_by: str = SHARD_BY,
+        shard_dir: str = SHARD_DIR,
+        only: Optional[Collection[str]] = None,
+    ):
+        if shard_by and shard_by not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode {shard_by!r}, use one of {SHARD_MODES}")
+        self.shard_by = shard_by
+        self.shard_dir = shard_dir
+        self.only = set(only) if only is not None else None
+        # Checkpoints, and all files when the index is not sharded
+        self.catalog = open_writer(db_file)
+        self._shards: Dict[str, sqlite3.Connection] = {}
+
+    def shard(self, name: str) -> sqlite3.Connection:
+        conn = self._shards.get(name)
+        if conn is None:
+            os.makedirs(self.shard_dir, exist_ok=True)
+            path = shard_path(name, self.shard_dir)
+            init_db(path, seed=False)
+            conn = self._shards[name] = open_writer(path)
+        return conn
+
+    def _existing_shards(self) -> List[str]:
+        return [os.path.basename(path)[:-3] for path in shard_files(self.shard_dir)]
+
+    def write_batch(
+        self,
+        messages: List[Tuple],
+        chat_id: int = LEGACY_CHAT_ID,
+        source: Optional[str] = None,
+        checkpoint: Optional[int] = None,
+    ) -> BatchResult:
+        """
+        Same as the `write_batch` function, spread over the shards.
+        """
+        if not self.shard_by:
+            return write_batch(self.catalog, messages, chat_id, source, checkpoint)
+
+        entries = [FileEntry(*entry) for entry in messages]
+        groups: DefaultDict[str, List[FileEntry]] = defaultdict(list)
+        for entry in entries:
+            name = shard_name(self.shard_by, chat_id, normalize_title(entry.title))
+            if self.only is None or name in self.only:
+                groups[name].append(entry)
+
+        if self.shard_by == "initial":
+            # An edit can rename a file into another shard
+            for name in self._existing_shards():
+                moved = [
+                    entry.message_id
+                    for other, group in groups.items()
+                    if other != name
+                    for entry in group
+                ]
+                if moved:
+                    delete_messages(self.shard(name), chat_id, moved)
+
+        indexed = duplicates = 0
+        for name, group in groups.items():
+            result = write_batch(self.shard(name), group, chat_id)
+            indexed += result.indexed
+            duplicates += result.duplicates
+
+        if checkpoint is None and entries:
+            checkpoint = max(entry.message_id for entry in entries)
+        if source is not None and checkpoint is not None:
+            with self.catalog:
+                save_checkpoint(self.catalog.cursor(), source, checkpoint)
+        return BatchResult(indexed, duplicates)
+
+    def delete_messages(self, chat_id: int, message_ids: List[int]) -> int:
+        if not self.shard_by:
+            return delete_messages(self.catalog, chat_id, message_ids)
+        if self.shard_by == "channel":
+            names = [shard_name(self.shard_by, chat_id, "")]
+            if not os.path.exists(shard_path(names[0], self.shard_dir)):
+                return 0
+        else:
+            names = self._existing_shards()
+        return sum(delete_messages(self.shard(name), chat_id, message_ids) for name in names)
+
+    def adopt_legacy_rows(self, chat_id: int) -> int:
+        # Shards are only ever written with resolved chat IDs
+        return adopt_legacy_rows(self.catalog, chat_id)
+
+    def load_checkpoint(self, source: str) -> int:
+        return load_checkpoint(self.catalog, source)
+
+    def close(self):
+        for conn in self._shards.values():
+            conn.close()
+        self._shards.clear()
+        self.catalog.close()
 
 
 def add_to_index(title: str, description: str, message_id: int):
-    base_title = extract_metadata(title)
-    quality = ",".join(QUALITY_PATTERN.findall(title))
+    writer = IndexWriter()
+    try:
+        writer.write_batch([(title, description, message_id)])
+    finally:
+        writer.close()
+
+
+def load_checkpoint(conn: sqlite3.Connection, channel: str) -> int:
+    row = conn.execute(
+        "SELECT last_message_id FROM index_checkpoints WHERE channel = ?", (channel,)
+    ).fetchone()
+    return row[0] if row else 0
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
 
-    # Avoid duplicate entries by deleting any existing ones with the same message_id
-    cursor.execute("DELETE FROM files WHERE message_id = ?", (message_id,))
+def save_checkpoint(cursor: sqlite3.Cursor, channel: str, message_id: int):
+    # Never moves backwards, so a replayed batch can not undo later progress
     cursor.execute(
         """
-            INSERT INTO files (base_title, original_title, description, quality, message_id) VALUES (?, ?, ?, ?, ?)
+            INSERT INTO index_checkpoints (channel, last_message_id) VALUES (?, ?)
+            ON CONFLICT(channel) DO UPDATE SET last_message_id = max(last_message_id, excluded.last_message_id)
         """,
-        (base_title, title, description, quality, message_id),
+        (channel, message_id),
     )
 
-    conn.commit()
-    conn.close()
-
 
-def load_last_indexed() -> int:
-    if not os.path.exists(LAST_INDEXED_FILE):
-        return 0
+def seed_checkpoint(cursor: sqlite3.Cursor):
+    """
+    Carry the checkpoint of the old `last_indexed.json` over to CHANNEL_NAME,
+    the only channel indexed before checkpoints moved into the database.
+    """
+    if not os.path.exists(LAST_INDEXED_FILE) or load_checkpoint(cursor.connection, CHANNEL_NAME):
+        return
     with open(LAST_INDEXED_FILE, "r") as f:
-        return json.load(f).get("last_indexed_id", 0)
+        state = json.load(f)
+    # Older versions wrote "last_message_id" but read "last_indexed_id"
+    message_id = max(state.get("last_message_id", 0), state.get("last_indexed_id", 0))
+    if message_id:
+        save_checkpoint(cursor, CHANNEL_NAME, message_id)
+        print(f"Imported checkpoint {message_id} for {CHANNEL_NAME} from {LAST_INDEXED_FILE}")
 
 
-def save_last_index(message_id: int):
-    with open(LAST_INDEXED_FILE, "w") as f:
-        json.dump({"last_message_id": message_id}, f, indent=2)
+def file_entry(message) -> Optional[FileEntry]:
+    """
+    What to index for a message, or None when it carries no file.
+    """
+    if not (message.document or message.video):
+        return None
 
+    title = message.file.name if message.file else "Unknown"
+    if not title:
+        return None
 
-async def scan_group(
-    client: TelegramClient, group_username: str, batch_size: int = 100
-):
-    last_indexed_id = load_last_indexed()
-    print(f"Starting from message ID: {last_indexed_id}")
+    document = message.document or message.video
+    return FileEntry(
+        title,
+        message.text or "",
+        message.id,
+        document.id,
+        message.file.size if message.file else None,
+        message.file.mime_type if message.file else None,
+        message.file.duration if message.file else None,
+        int(message.date.timestamp()) if message.date else None,
+    )
+
+
+class LiveIndexer:
+    """
+    Keeps the index current from new, edited and deleted channel messages.
+
+    Events only record the change. The first one starts a short timer and
+    everything recorded by the time it fires is written in one batch, on a
+    thread of its own so the event loop never waits for SQLite. Only the
+    latest change of each message is kept, so a burst of edits costs a
+    single write.
 
-    messages_batch = []
+    Checkpoints are left alone: messages posted while the bot was offline
+    are still picked up by the next scan, and indexing a message twice just
+    replaces its row.
+    """
 
-    async for message in client.iter_messages(
-        group_username, min_id=last_indexed_id, reverse=True
+    def __init__(
+        self,
+        db_file: str = DB_FILE,
+        delay: float = LIVE_FLUSH_DELAY,
+        max_pending: int = BATCH_SIZE,
     ):
-        if message.document or message.video:
-            title = message.file.name if message.file else "Unknown"
-            description = message.text or ""
+        self._db_file = db_file
+        self._delay = delay
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._writer: Optional[IndexWriter] = None
+        # chat_id -> message_id -> entry to index, or None to delete
+        self._pending: DefaultDict[int, Dict[int, Optional[FileEntry]]] = defaultdict(dict)
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        # Set once `max_pending` changes are waiting, to write them at once
+        self._full = asyncio.Event()
+        self._closing = False
+        # Loop the indexer runs on; its locks and tasks belong to it
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self, legacy_chat_id: Optional[int] = None):
+        """
+        Open the index writer. Files indexed before channels were recorded
+        are assigned to `legacy_chat_id` first, so their edits replace them
+        instead of adding a second row.
+        """
+        loop = self._loop = asyncio.get_running_loop()
+        self._writer = await loop.run_in_executor(self._executor, IndexWriter, self._db_file)
+        if legacy_chat_id is not None:
+            await loop.run_in_executor(
+                self._executor, self._writer.adopt_legacy_rows, legacy_chat_id
+            )
+
+    def upsert(self, chat_id: int, message):
+        # An edit can remove the file, which takes the message out of the index
+        self._record(chat_id, message.id, file_entry(message))
+
+    def delete(self, chat_id: int, message_ids: List[int]):
+        for message_id in message_ids:
+            self._record(chat_id, message_id, None)
+
+    def _record(self, chat_id: int, message_id: int, entry: Optional[FileEntry]):
+        self._pending[chat_id][message_id] = entry
+
+        if sum(map(len, self._pending.values())) >= self._max_pending:
+            self._full.set()
+        self._schedule()
 
-            if not title:
+    def _schedule(self):
+        # A single task writes everything pending, so events never pile up
+        # tasks of their own
+        if self._flush_task is None and not self._closing:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            while self._pending:
+                if not self._full.is_set():
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self._delay)
+                    except asyncio.TimeoutError:
+                        pass
+                self._full.clear()
+
+                if not await self.flush():
+                    if self._closing:
+                        return
+                    # Give a failing write a moment before trying again
+                    await asyncio.sleep(self._delay)
+        finally:
+            self._flush_task = None
+
+    async def flush(self) -> bool:
+        """
+        Write everything pending. Changes that could not be written are
+        kept and retried.
+
+        Returns:
+            bool: False if the write failed or the writer is not open yet
+        """
+        async with self._flush_lock:
+            pending, self._pending = self._pending, defaultdict(dict)
+            if not pending:
+                return True
+            if self._writer is None:
+                self._merge(pending)
+                return False
+
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                indexed, duplicates, deleted = await loop.run_in_executor(
+                    self._executor, self._write, pending
+                )
+            except Exception as e:
+                print(f"❌ Live index update failed, retrying: {e}")
+                self._merge(pending)
+                self._schedule()
+                return False
+
+        print(
+            f"Live index: {indexed} files indexed, {duplicates} duplicates, {deleted} removed "
+            f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        return True
+
+    def _merge(self, pending: Dict[int, Dict[int, Optional[FileEntry]]]):
+        # Put unwritten changes back without overriding newer ones
+        for chat_id, changes in pending.items():
+            for message_id, entry in changes.items():
+                self._pending[chat_id].setdefault(message_id, entry)
+
+    def _write(self, pending: Dict[int, Dict[int, Optional[FileEntry]]]) -> Tuple[int, int, int]:
+        indexed = duplicates = deleted = 0
+        for chat_id, changes in pending.items():
+            removed = [message_id for message_id, entry in changes.items() if entry is None]
+            if removed:
+                deleted += self._writer.delete_messages(chat_id, removed)
+
+            messages = [entry for entry in changes.values() if entry]
+            if messages:
+                result = self._writer.write_batch(messages, chat_id)
+                indexed += result.indexed
+                duplicates += result.duplicates
+        return indexed, duplicates, deleted
+
+    @asynccontextmanager
+    async def paused(self) -> AsyncIterator[None]:
+        """
+        Write everything pending, then hold further writes until the block
+        ends. Events keep being recorded in the meantime.
+        """
+        await self.flush()
+        async with self._flush_lock:
+            yield
+
+    async def run_paused(self, function: Callable, *args):
+        """
+        Run a blocking `function` on a thread while live writes are held,
+        see `paused`. Callable from any event loop: the pause itself runs
+        on the indexer's own.
+        """
+
+        async def run():
+            async with self.paused():
+                return await asyncio.to_thread(function, *args)
+
+        if self._loop is None or self._loop is asyncio.get_running_loop():
+            return await run()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(run(), self._loop))
+
+    async def close(self):
+        # Let a running flush finish instead of dropping the batch it holds
+        self._closing = True
+        self._full.set()
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+
+        if self._writer is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._writer.close)
+            self._writer = None
+        self._executor.shutdown()
+
+
+class IndexBatch(NamedTuple):
+    source: str  # Channel as configured, the checkpoint key
+    chat_id: int
+    messages: List[FileEntry]
+    checkpoint: int  # Last message scanned, with or without a file
+
+
+def parse_channel(channel: str) -> Union[str, int]:
+    # Chat IDs come in as text from the environment
+    return int(channel) if channel.lstrip("-").isdigit() else channel
+
+
+async def scan_channel(
+    client: TelegramClient,
+    source: str,
+    chat_id: int,
+    last_indexed_id: int,
+    queue: asyncio.Queue,
+    semaphore: asyncio.Semaphore,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Stream the new messages of one channel into the writer queue.
+
+    Returns:
+        int: Number of messages scanned
+    """
+    async with semaphore:
+        print(f"[{source}] Starting from message ID: {last_indexed_id}")
+        messages_batch = []
+        last_seen_id = last_indexed_id
+        scanned = 0
+
+        async for message in client.iter_messages(
+            chat_id, min_id=last_indexed_id, reverse=True
+        ):
+            last_seen_id = message.id
+            scanned += 1
+            entry = file_entry(message)
+            if entry is None:
                 continue
 
-            messages_batch.append((title, description, message.id))
+            messages_batch.append(entry)
 
             if len(messages_batch) >= batch_size:
-                for title, description, message_id in messages_batch:
-                    add_to_index(title, description, message_id)
-                    save_last_index(message_id)
-                    print(f"Indexed: {title} (ID: {message_id})")
-                messages_batch.clear()
+                # Waits here while the writer is behind
+                await queue.put(IndexBatch(source, chat_id, messages_batch, last_seen_id))
+                messages_batch = []
+
+        # Process any remaining, and skip trailing messages without files
+        if messages_batch or last_seen_id > last_indexed_id:
+            await queue.put(IndexBatch(source, chat_id, messages_batch, last_seen_id))
+
+    print(f"[{source}] Scanned {scanned} new messages")
+    return scanned
+
 
-    # Process any remaining
-    for title, description, message_id in messages_batch:
-        add_to_index(title, description, message_id)
-        save_last_index(message_id)
-        print(f"Indexed: {title} (ID: {message_id})")
+async def write_batches(
+    queue: asyncio.Queue, writer: IndexWriter, executor: ThreadPoolExecutor
+) -> BatchResult:
+    """
+    Single writer: commit queued batches one at a time until a None arrives.
+
+    Returns:
+        BatchResult: Files indexed and duplicates found over all batches
+    """
+    loop = asyncio.get_running_loop()
+    indexed = duplicates = 0
+
+    while True:
+        batch = await queue.get()
+        if batch is None:
+            return BatchResult(indexed, duplicates)
+
+        started = time.perf_counter()
+        # The checkpoint commits together with the rows it covers
+        result = await loop.run_in_executor(
+            executor,
+            writer.write_batch,
+            batch.messages,
+            batch.chat_id,
+            batch.source,
+            batch.checkpoint,
+        )
+        indexed += result.indexed
+        duplicates += result.duplicates
 
-    print("Indexing completed!!")
+        if batch.messages:
+            elapsed = time.perf_counter() - started
+            print(
+                f"[{batch.source}] Indexed {result.indexed} files up to ID "
+                f"{batch.messages[-1].message_id}, skipped {result.duplicates} duplicates "
+                f"({len(batch.messages) / elapsed:,.0f} rows/s, {indexed} total)"
+            )
+
+
+async def scan_channels(
+    client: TelegramClient,
+    channels: List[str],
+    batch_size: int = BATCH_SIZE,
+    max_concurrent: int = MAX_CONCURRENT_SCANS,
+    make_writer: Callable[[], IndexWriter] = IndexWriter,
+):
+    """
+    Index several channels concurrently.
+
+    Up to `max_concurrent` channels are streamed at once and all of them
+    feed one writer, so SQLite only ever sees a single writing connection
+    and the total time follows the slowest channel. `make_writer` opens
+    that writer, on the thread that will use it.
+    """
+    loop = asyncio.get_running_loop()
+    # One thread owns the writer connections for their whole life
+    executor = ThreadPoolExecutor(max_workers=1)
+    writer = await loop.run_in_executor(executor, make_writer)
+
+    try:
+        chat_ids = {}
+        for source in channels:
+            entity = await client.get_entity(parse_channel(source))
+            chat_ids[source] = utils.get_peer_id(entity)
+            if source == CHANNEL_NAME:
+                await loop.run_in_executor(
+                    executor, writer.adopt_legacy_rows, chat_ids[source]
+                )
+
+        checkpoints = {
+            source: await loop.run_in_executor(executor, writer.load_checkpoint, source)
+            for source in channels
+        }
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        semaphore = asyncio.Semaphore(max_concurrent)
+        started = time.perf_counter()
+        writing = asyncio.create_task(write_batches(queue, writer, executor))
+
+        scans = asyncio.gather(
+            *(
+                scan_channel(
+                    client,
+                    source,
+                    chat_ids[source],
+                    checkpoints[source],
+                    queue,
+                    semaphore,
+                    batch_size,
+                )
+                for source in channels
+            ),
+            return_exceptions=True,
+        )
+        await asyncio.wait({scans, writing}, return_when=asyncio.FIRST_COMPLETED)
+        if writing.done():
+            # The writer only stops early on an error; scans would block on the queue
+            scans.cancel()
+            writing.result()
+
+        results = await scans
+        await queue.put(None)
+        indexed, duplicates = await writing
+        elapsed = time.perf_counter() - started
+
+        for source, result in zip(channels, results):
+            if isinstance(result, Exception):
+                # Its checkpoint stays at the last committed batch
+                print(f"❌ [{source}] Scan failed: {result}")
+
+        print(
+            f"Indexing completed!! {indexed} files from {len(channels)} channels in "
+            f"{elapsed:.1f}s ({indexed / elapsed if elapsed else 0:,.0f} rows/s), "
+            f"{duplicates} duplicates skipped"
+        )
+    finally:
+        await loop.run_in_executor(executor, writer.close)
+        executor.shutdown()
+
+
+async def scan_group(
+    client: TelegramClient, group_username: str, batch_size: int = BATCH_SIZE
+):
+    await scan_channels(client, [group_username], batch_size)
 
 
 async def main():
@@ -119,8 +1473,28 @@ async def main():
 
     init_db()
     async with TelegramClient(SESSION_NAME, API_ID, API_HASH) as client:
-        await scan_group(client, CHANNEL_NAME)
+        await scan_channels(client, INDEX_CHANNELS)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Index the source channels.")
+    parser.add_argument(
+        "--duplicates", action="store_true", help="Print the duplicate report and exit"
+    )
+    parser.add_argument(
+        "--reextract",
+        action="store_true",
+        help="Extract the metadata of all indexed files again and exit",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Processes used by --reextract, one per CPU by default"
+    )
+    args = parser.parse_args()
+
+    if args.duplicates:
+        print_duplicate_report()
+    elif args.reextract:
+        init_db()
+        reextract_metadata(workers=args.workers)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,243 @@
+"""
+Release metadata of file names: season, episode range, year, languages,
+codec, resolution and part number, read in a single pass.
+
+    >>> extract("Mirzapur.S02E01-E03.1080p.WEB-DL.Hindi.x265.mkv")
+    TitleMetadata(base_title='Mirzapur.S02E01-E03...Hindi.x265.mkv', ...,
+                  season=2, episode=1, episode_end=3, languages='hindi',
+                  codec='x265', resolution=1080, ...)
+"""
+
+import re
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, NamedTuple, Optional
+
+from normalizer import _END, _START, normalize_title
+
+# Bump whenever the rules below change, so stored metadata is re-extracted
+METADATA_VERSION = 2
+
+# Titles handed to each worker process at a time
+CHUNK_SIZE = 2000
+
+_SEP = r"[\s._-]?"
+_RANGE = r"[\s._]*(?:-|~|to)[\s._]*"
+
+LANGUAGES = {
+    "hindi": "hindi",
+    "english": "english",
+    "eng": "english",
+    "tamil": "tamil",
+    "telugu": "telugu",
+    "malayalam": "malayalam",
+    "kannada": "kannada",
+    "bengali": "bengali",
+    "marathi": "marathi",
+    "punjabi": "punjabi",
+    "gujarati": "gujarati",
+    "urdu": "urdu",
+    "korean": "korean",
+    "japanese": "japanese",
+    "chinese": "chinese",
+    "spanish": "spanish",
+    "french": "french",
+    "german": "german",
+    "dual": "dual audio",
+    "multi": "multi audio",
+}
+
+CODECS = {
+    "x264": "x264",
+    "h264": "x264",
+    "avc": "x264",
+    "x265": "x265",
+    "h265": "x265",
+    "hevc": "x265",
+    "av1": "av1",
+    "vp9": "vp9",
+}
+
+# Numerals the part pattern accepts, largest first
+ROMAN_NUMERALS = [(10, "x"), (9, "ix"), (5, "v"), (4, "iv"), (1, "i")]
+
+# Characters a token can start with: digits, S(eason), E(pisode), the
+# source tags, 4K/UHD, codecs, languages and P(art). Checked before the
+# alternatives below, which skips most positions of a title at once; keep
+# it in step with them.
+_FIRST_CHARS = "".join(
+    sorted(set("0123456789" + "se" + "hwp" + "u" + "xhav" + "".join(name[0] for name in LANGUAGES)))
+)
+
+# Every rule is one alternative of a single pattern, so a title is scanned
+# once. Earlier alternatives win at the same position: "S01E02" is read as
+# season and episode before "S01" alone could match.
+TOKEN_PATTERN = re.compile(
+    rf"(?=[{_FIRST_CHARS}])(?:"
+    + "|".join(
+        [
+            # S01E02, S01 E02, S01E02-E05
+            _START
+            + rf"S(?P<se_season>\d{{1,2}}){_SEP}E(?P<se_episode>\d{{1,3}})"
+            + rf"(?:{_RANGE}E?(?P<se_end>\d{{1,3}}))?"
+            + _END,
+            # S01, Season 1, and the season of odd forms such as S01E0508
+            _START + rf"(?:S|Season{_SEP})(?P<season>\d{{1,2}})(?:{_END}|(?=E\d))",
+            # E02, EP02, Episode 2, EP01-10
+            _START
+            + rf"(?:EP?|Episode){_SEP}(?P<episode>\d{{1,3}})"
+            + rf"(?:{_RANGE}(?:EP?|Episode)?{_SEP}(?P<episode_end>\d{{1,3}}))?"
+            + _END,
+            # Release years, but not resolutions such as 1920x1080
+            r"(?<![\dx])(?P<year>(?:19|20)\d{2})(?![\dpx])",
+            # Resolutions and source tags make up the quality label
+            r"(?<!\d)(?P<resolution>\d{3,4})p",
+            r"(?P<source>HDRip|WEB-DL|PreDVD)",
+            _START + r"(?P<uhd>4k|uhd)" + _END,
+            _START + rf"(?P<codec>[xh]{_SEP}26[45]|hevc|avc|av1|vp9)" + _END,
+            _START
+            + r"(?P<language>"
+            + "|".join(sorted(LANGUAGES, key=len, reverse=True))
+            + r")(?:[\s._-]?audio)?"
+            + _END,
+            _START + rf"(?:part|pt){_SEP}(?P<part>\d{{1,2}}|[ivx]{{1,4}})" + _END,
+        ]
+    )
+    + ")",
+    re.IGNORECASE,
+)
+
+SPACES_PATTERN = re.compile(r"\s+")
+TRAILING_PATTERN = re.compile(r"[-\s]+$")
+
+
+class TitleMetadata(NamedTuple):
+    base_title: str  # File name without quality tags, for display
+    search_key: str  # Normalized title, see `normalize_title`
+    quality: str  # Resolution and source tags as written, comma separated
+    resolution: Optional[int]  # Vertical lines, 2160 for 4K
+    codec: Optional[str]
+    languages: str  # Comma separated, in order of appearance
+    year: Optional[int]
+    season: Optional[int]
+    episode: Optional[int]
+    episode_end: Optional[int]  # Last episode of a range such as E01-E05
+    part: Optional[int]
+
+
+def _roman(number: int) -> str:
+    numeral = ""
+    for value, letters in ROMAN_NUMERALS:
+        count, number = divmod(number, value)
+        numeral += letters * count
+    return numeral
+
+
+def _number(text: str) -> Optional[int]:
+    if text.isdigit():
+        return int(text)
+
+    # Parse the numeral, then keep it only if it is written the usual way,
+    # so "IIII" or "VX" give no part rather than a guess
+    values = {"i": 1, "v": 5, "x": 10}
+    digits = [values[letter] for letter in text.lower()]
+    number = sum(
+        -digit if digit < following else digit
+        for digit, following in zip(digits, digits[1:] + [0])
+    )
+    return number if number > 0 and _roman(number) == text.lower() else None
+
+
+def extract(title: str) -> TitleMetadata:
+    """
+    Metadata of one file name. Only the first season, episode, year,
+    codec and part found are kept; languages and quality tags collect.
+    """
+    year = season = episode = episode_end = part = resolution = None
+    codec = None
+    languages: List[str] = []
+    quality: List[str] = []
+    base_parts: List[str] = []
+    position = 0
+
+    for match in TOKEN_PATTERN.finditer(title):
+        group = match.lastgroup
+        if group in ("se_season", "se_episode", "se_end"):
+            if season is None:
+                season = int(match.group("se_season"))
+            if episode is None:
+                episode = int(match.group("se_episode"))
+                if match.group("se_end"):
+                    episode_end = int(match.group("se_end"))
+        elif group == "season":
+            if season is None:
+                season = int(match.group("season"))
+        elif group in ("episode", "episode_end"):
+            if episode is None:
+                episode = int(match.group("episode"))
+                if match.group("episode_end"):
+                    episode_end = int(match.group("episode_end"))
+        elif group == "year":
+            if year is None:
+                year = int(match.group("year"))
+        elif group in ("resolution", "source"):
+            if group == "resolution" and resolution is None:
+                resolution = int(match.group("resolution"))
+            quality.append(match.group())
+            # Quality tags are left out of the display title
+            base_parts.append(title[position : match.start()])
+            position = match.end()
+        elif group == "uhd":
+            if resolution is None:
+                resolution = 2160
+        elif group == "codec":
+            if codec is None:
+                codec = CODECS[re.sub(r"[\s._-]", "", match.group("codec")).lower()]
+        elif group == "language":
+            language = LANGUAGES[match.group("language").lower()]
+            if language not in languages:
+                languages.append(language)
+        elif group == "part":
+            if part is None:
+                part = _number(match.group("part"))
+
+    base_parts.append(title[position:])
+    base_title = SPACES_PATTERN.sub(" ", "".join(base_parts)).strip()
+    base_title = TRAILING_PATTERN.sub("", base_title)
+
+    return TitleMetadata(
+        base_title,
+        normalize_title(title),
+        ",".join(quality),
+        resolution,
+        codec,
+        ",".join(languages),
+        year,
+        season,
+        episode,
+        episode_end,
+        part,
+    )
+
+
+def extract_batch(titles: Iterable[str]) -> List[TitleMetadata]:
+    return [extract(title) for title in titles]
+
+
+def extract_parallel(
+    titles: List[str], workers: Optional[int] = None, chunk_size: int = CHUNK_SIZE
+) -> List[TitleMetadata]:
+    """
+    `extract_batch` spread over worker processes, for re-extracting a whole
+    index. Results keep the order of `titles`.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(titles) <= chunk_size:
+        return extract_batch(titles)
+
+    chunks = [titles[i : i + chunk_size] for i in range(0, len(titles), chunk_size)]
+    results: List[TitleMetadata] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in pool.map(extract_batch, chunks):
+            results.extend(batch)
+    return results
@@ -0,0 +1,61 @@
+"""
+Backfill `end_ts`, the plan end as epoch seconds, for users that only have
+the `end_date` string.
+
+The bot schedules expiries from its users mirror. Until the mirror is
+loaded it range-queries `end_ts` for the plans ending within the notice
+window, which needs the `.indexOn` in database.rules.json. Deploying that
+file replaces every rule the project has, including its read and write
+rules, so merge the index into the existing rules instead of running
+`firebase deploy --only database` with it as is. Users without `end_ts`
+are included by that query and read by their `end_date`, so the bot can
+keep running while this runs.
+
+    python migrate_expiry.py --dry-run
+    python migrate_expiry.py
+"""
+
+import argparse
+
+from firebase_admin import db
+from firebase import end_timestamp, logger
+
+# Users written per multi-path update
+BATCH_SIZE = 500
+
+
+def backfill_end_timestamps(batch_size: int = BATCH_SIZE, dry_run: bool = False) -> int:
+    users = db.reference("users").get() or {}
+    updates = {}
+    for user_id, data in users.items():
+        if not isinstance(data, dict) or "end_ts" in data:
+            continue
+        try:
+            end_ts = end_timestamp(data)
+        except ValueError as e:
+            logger.error(f"🔥 Cannot parse end date of user {user_id}: {e}")
+            continue
+        if end_ts is not None:
+            updates[f"{user_id}/end_ts"] = end_ts
+
+    logger.info(f"🕒 {len(updates)} of {len(users)} users need an end timestamp.")
+    if dry_run:
+        return len(updates)
+
+    paths = list(updates)
+    for i in range(0, len(paths), batch_size):
+        db.reference("users").update({path: updates[path] for path in paths[i : i + batch_size]})
+        logger.info(f"✅ Backfilled {min(i + batch_size, len(paths))}/{len(paths)} users.")
+    return len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the users to update")
+    args = parser.parse_args()
+    backfill_end_timestamps(args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Convert an existing index.db in place to the `media` layout.
+
+Copies the database to a backup first, moves every indexed file into the
+typed `media` table, rebuilds the external-content full-text indexes, checks
+them and vacuums away the old tables.
+
+    python migrate_index.py
+    python migrate_index.py --db index.db --backup index.db.bak
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+
+from indexing_with_sqlite import DB_FILE, file_size, init_db, table_exists
+
+
+def migrate(db_file: str, backup: str = ""):
+    if not os.path.exists(db_file):
+        print(f"❌ {db_file} does not exist")
+        return
+
+    conn = sqlite3.connect(db_file)
+    if table_exists(conn.cursor(), "media"):
+        print(f"✅ {db_file} already uses the media table")
+        conn.close()
+        return
+
+    if backup:
+        if os.path.exists(backup):
+            os.remove(backup)
+        conn.execute("VACUUM INTO ?", (backup,))
+        print(f"💾 Backup written to {backup}")
+    conn.close()
+
+    size_before = file_size(db_file)
+    started = time.perf_counter()
+    init_db(db_file)
+
+    conn = sqlite3.connect(db_file)
+    # Both raise if an index disagrees with the media table
+    conn.execute("INSERT INTO media_fts (media_fts) VALUES ('integrity-check')")
+    conn.execute("INSERT INTO title_trigrams (title_trigrams) VALUES ('integrity-check')")
+    files = conn.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    size_after = file_size(db_file)
+    print(
+        f"✅ Migrated {files} files in {elapsed:.1f}s, "
+        f"{size_before / 1024 / 1024:.1f} MiB → {size_after / 1024 / 1024:.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument(
+        "--backup", help="Backup path, <db>.bak by default; pass '' to skip"
+    )
+    args = parser.parse_args()
+
+    backup = f"{args.db}.bak" if args.backup is None else args.backup
+    migrate(args.db, backup)
+
+
+if __name__ == "__main__":
+    main()
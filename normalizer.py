@@ -0,0 +1,121 @@
+import re
+
+# Lookarounds used instead of \b so underscores count as separators, as
+# they do in release names like "Narcos_S01_E03_720p_x264"
+_START = r"(?<![^\W_])"
+_END = r"(?![^\W_])"
+
+# Release groups, sites and platform tags that never belong to a title
+NOISE_WORDS = [
+    "mkvcinemas",
+    "hdhub4u",
+    "pahe",
+    "cinevood",
+    "youthtrendx",
+    "vegamovies",
+    "bollyflix",
+    "skymovieshd",
+    "htpmovies",
+    "maxplayhd",
+    "moviesmod",
+    "katmoviehd",
+    "filmyzilla",
+    "1tamilmv",
+    "tamilmv",
+    "tamilblasters",
+    "psa",
+    "rarbg",
+    "yts",
+    "nf",
+    "amzn",
+    "dsnp",
+    "hmax",
+    "sonyliv",
+    "zee5",
+    "hotstar",
+    "jiocinema",
+    "wiki",
+    "org",
+    "hq",
+    "esubs?",
+    "msubs?",
+    "hdrip",
+    "webrip",
+    "web",
+    "predvd",
+    "hdtv",
+    "bluray",
+    "brrip",
+    "dvdrip",
+    "camrip",
+    "hdcam",
+    "hdtc",
+    "mkv",
+    "mp4",
+]
+
+# (pattern, replacement) pairs applied in order; compiled once at import
+NORMALIZE_RULES = [
+    # Site prefixes such as "www_HTPMovies_art_" or "www.1TamilMV.com - "
+    (re.compile(r"^\s*www[\W_]+[^\W_]+[\W_]+[a-z]{2,4}" + _END, re.IGNORECASE), " "),
+    # Channel handles and links
+    (re.compile(r"@\w+|t\.me/\S+|https?://\S+", re.IGNORECASE), " "),
+    # File sizes and bitrates such as 1.6GB, 77MB, 192Kbps
+    (
+        re.compile(_START + r"\d+(?:[\W_]\d+)?[\W_]?(?:mb|gb|kbps)" + _END, re.IGNORECASE),
+        " ",
+    ),
+    # Dotted or dashed tags that would fall apart once separators go
+    (
+        re.compile(
+            _START
+            + r"(?:web[\W_]?dl|[xh][\W_]?26[45]|dd[p+]?\d[\W_]?\d|aac\d[\W_]?\d|\d[\W_]\d)"
+            + _END,
+            re.IGNORECASE,
+        ),
+        " ",
+    ),
+    # Codecs, resolutions, bit depths and audio formats
+    (
+        re.compile(
+            _START
+            + r"(?:hevc|avc|aac|ac3|ddp?|atmos|10bit|8bit|\d{3,4}p|4k|uhd|hdr(?:10)?)"
+            + _END,
+            re.IGNORECASE,
+        ),
+        " ",
+    ),
+    # Release groups and source tags
+    (re.compile(_START + r"(?:" + "|".join(NOISE_WORDS) + r")" + _END, re.IGNORECASE), " "),
+    # Every remaining separator becomes a single space
+    (re.compile(r"[\W_]+"), " "),
+]
+
+
+# Uploader brands glued to the front of a file name, as in
+# "TheMoviesBoss_Mismatched_S02E04": three or more capitalized words run
+# together, followed by a separator and more of a title
+UPLOADER_PATTERN = re.compile(r"^\s*(?:[A-Z][a-z\d]+){3,}[\W_]+(?=.*[^\W\d_]{3})")
+
+
+def normalize_title(text: str) -> str:
+    """
+    Search key of a file name or request: case-folded, release noise
+    removed and separators unified, e.g.
+
+        "www_HTPMovies_art_Andor_S01E06_The_Eye_1080p_HQ_DSNP_WEB_DL_x264.mkv"
+        -> "andor s01e06 the eye"
+    """
+    for pattern, replacement in NORMALIZE_RULES:
+        text = pattern.sub(replacement, text)
+    return text.strip().casefold()
+
+
+def release_key(base_title: str) -> str:
+    """
+    Normalized title of a release for grouping its re-uploads, which only
+    differ by a leading uploader tag, e.g.
+
+        "TheMoviesBoss_Mismatched_S02E04" -> "mismatched s02e04"
+    """
+    return normalize_title(UPLOADER_PATTERN.sub(" ", base_title, count=1))
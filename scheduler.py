@@ -0,0 +1,150 @@
+"""
+Deadline scheduler for the bot's timed jobs: plan reminders, expiries and
+removals after the grace period.
+
+Jobs wait in a min-heap ordered by deadline and the runner sleeps until the
+earliest one, so nothing is polled while the next deadline is days away.
+Each job has a key; scheduling under a key that is already taken moves the
+job, for example when a plan is extended. A job that raises is retried
+with a growing delay unless its key was scheduled again in the meantime.
+
+    scheduler = DeadlineScheduler()
+    scheduler.schedule(("notice", user_id), end_ts, send_notice)
+    await scheduler.run()
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+Action = Callable[[], Awaitable[None]]
+
+# Longest single sleep. Deadlines are wall-clock times while asyncio sleeps
+# on the monotonic clock, so waking now and then keeps a clock change or a
+# suspended host from delaying jobs by much.
+MAX_SLEEP = 60 * 60
+
+# Moved and cancelled jobs leave their heap entry behind until it is popped;
+# the heap is rebuilt once it holds this many more entries than jobs
+STALE_ENTRIES = 1024
+
+# Delay before retrying a failed job, doubled on each further failure up
+# to the cap
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._jobs: Dict[Hashable, Tuple[float, int, Action, int]] = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._running: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def schedule(self, key: Hashable, deadline: float, action: Action):
+        """
+        Run `action` at `deadline`, replacing any job under `key`. Safe to
+        call from any thread; a deadline in the past runs at once.
+
+        Args:
+            key: Identifies the job, for moving or cancelling it.
+            deadline: Epoch seconds.
+            action: Coroutine function called without arguments.
+        """
+        self._push(key, deadline, action, 0)
+
+    def _push(self, key: Hashable, deadline: float, action: Action, failures: int, replace: bool = True) -> bool:
+        with self._lock:
+            # A retry must not replace a job scheduled under its key meanwhile
+            if not replace and key in self._jobs:
+                return False
+            entry = (deadline, next(self._counter), key)
+            self._jobs[key] = (deadline, entry[1], action, failures)
+            if len(self._heap) > len(self._jobs) + STALE_ENTRIES:
+                self._heap = [(job[0], job[1], job_key) for job_key, job in self._jobs.items()]
+                heapq.heapify(self._heap)
+            else:
+                heapq.heappush(self._heap, entry)
+            earliest = self._heap[0][1] == entry[1]
+
+        # Only a new earliest job changes how long the runner sleeps
+        if earliest:
+            self._wake()
+        return True
+
+    def cancel(self, key: Hashable):
+        with self._lock:
+            self._jobs.pop(key, None)
+
+    def _wake(self):
+        loop, wakeup = self._loop, self._wakeup
+        if loop is not None and wakeup is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def _pop_due(self, now: float) -> List[Tuple[Hashable, Action, int]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, seq, key = heapq.heappop(self._heap)
+                job = self._jobs.get(key)
+                if job is None or job[1] != seq:
+                    continue
+                del self._jobs[key]
+                due.append((key, job[2], job[3]))
+        return due
+
+    def _next_deadline(self) -> Optional[float]:
+        with self._lock:
+            while self._heap:
+                deadline, seq, key = self._heap[0]
+                job = self._jobs.get(key)
+                if job is not None and job[1] == seq:
+                    return deadline
+                heapq.heappop(self._heap)
+        return None
+
+    async def _run_job(self, key: Hashable, action: Action, failures: int):
+        try:
+            await action()
+        except Exception as e:
+            delay = min(RETRY_DELAY * 2 ** failures, MAX_RETRY_DELAY)
+            if self._push(key, time.time() + delay, action, failures + 1, replace=False):
+                logger.error(f"💥 Scheduled job {key} failed, retrying in {delay}s: {e}")
+            else:
+                logger.error(f"💥 Scheduled job {key} failed, already rescheduled: {e}")
+
+    async def run(self):
+        """Run jobs as they fall due, until cancelled."""
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        logger.info(f"⏰ Scheduler started with {len(self)} jobs.")
+
+        while True:
+            # Cleared before looking at the heap, so a job scheduled from
+            # here on wakes the wait below
+            self._wakeup.clear()
+            for key, action, failures in self._pop_due(time.time()):
+                task = asyncio.create_task(self._run_job(key, action, failures))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            deadline = self._next_deadline()
+            timeout = MAX_SLEEP if deadline is None else min(MAX_SLEEP, deadline - time.time())
+            if timeout <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,20 +1,958 @@
+import os
+import re
+import time
+import queue
+import asyncio
 import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+from normalizer import normalize_title, release_key
+from title_index import TitleCatalog
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
 
+logger = logging.getLogger(__name__)
 
-def search_files(query: str):
-    conn = sqlite3.connect("index.db")
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            """
-                SELECT original_title, message_id, quality FROM files WHERE files MATCH ?
-            """,
-            (query + "*",),
+DB_FILE = "index.db"
+
+# Set INDEX_SHARD_BY to search the shard files in INDEX_SHARD_DIR instead of
+# DB_FILE, see `indexing_with_sqlite.IndexWriter`
+SHARD_BY = os.getenv("INDEX_SHARD_BY", "")
+SHARD_DIR = os.getenv("INDEX_SHARD_DIR", "index_shards")
+
+# Read connection tuning
+POOL_SIZE = 4
+SHARD_RESCAN_INTERVAL = 5  # Seconds between looks for new shard files
+CACHE_SIZE_KIB = 16 * 1024  # Page cache per connection (16 MiB)
+MMAP_SIZE = 256 * 1024 * 1024  # Map up to 256 MiB of the file
+STATEMENT_CACHE_SIZE = 64  # Compiled statements kept per connection
+ACQUIRE_TIMEOUT = 10  # Seconds to wait for a free connection
+
+# Async search limits
+SEARCH_TIMEOUT = 5  # Seconds before a query is interrupted
+MAX_PENDING = 64  # Queries allowed to wait for a worker
+
+# Result cache limits
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 8 * 1024 * 1024
+CACHE_TTL = 10 * 60  # Seconds
+
+# Ranking and result limits
+PAGE_SIZE = 10  # Files delivered per request
+MAX_RESULTS = 50  # Hard cap on how deep a query can be paged
+COLLAPSE_WINDOW = 10 * MAX_RESULTS  # Best matches considered for collapsing
+
+# bm25() weights in `media_fts` column order: base_title, original_title,
+# description, search_key. Title words are matched on both titles and the
+# search key, so a hit in the display title ranks above one only in the
+# file name; descriptions are never matched (see `compile_query`).
+BM25_WEIGHTS = (5.0, 3.0, 0.0, 1.0)
+
+# `media_fts` columns the title words of a request are matched on
+TITLE_COLUMNS = ("base_title", "original_title", "search_key")
+
+# Added to the score (lower ranks first) of files whose name has no year
+# when a year was requested, so they follow every file of that year. The
+# year may be in the caption only, so such files are not left out.
+UNKNOWN_YEAR_PENALTY = 1000.0
+
+# Typo-tolerant fallback, only tried when a query finds nothing
+FUZZY_MAX_TRIGRAMS = 24  # Query trigrams used to look up candidates
+FUZZY_CANDIDATES = 100  # Titles scored per lookup
+FUZZY_TIME_BUDGET = 0.15  # Seconds the candidate lookup may run
+FUZZY_MIN_SCORE = 0.75  # Lowest similarity accepted for a corrected word
+
+# The year and season filters use the indexed columns of `media`; files
+# without a year pass the year filter, ranked after those of the year.
+#
+# Uploads of the same release (same base title, quality and episode) are
+# collapsed to the newest one, and each kept row carries how many copies it
+# hides. Base titles are compared by `release_key`, so re-uploads under an
+# uploader tag group with the rest. The matches are materialized first
+# because bm25() can not be evaluated inside a windowed query, and only the
+# best COLLAPSE_WINDOW of them are grouped so a one-word query neither sorts
+# every match in the index nor computes a release key for each.
+SEARCH_SQL = f"""
+    WITH matches AS MATERIALIZED (
+        SELECT
+            media.id,
+            media.original_title,
+            media.message_id,
+            media.quality,
+            media.base_title,
+            media.channel,
+            media.episode,
+            bm25(media_fts, {", ".join(map(str, BM25_WEIGHTS))})
+                + IIF(:year IS NOT NULL AND media.year IS NULL, {UNKNOWN_YEAR_PENALTY}, 0)
+                AS score
+        FROM media_fts
+        JOIN media ON media.id = media_fts.rowid
+        WHERE media_fts MATCH :match
+            AND (:year IS NULL OR media.year = :year OR media.year IS NULL)
+            AND (:season IS NULL OR media.season = :season)
+        ORDER BY score
+        LIMIT :window
+    )
+    SELECT original_title, message_id, quality, channel, copies - 1, release, episode, score
+    FROM (
+        SELECT
+            *,
+            ROW_NUMBER() OVER (
+                PARTITION BY release, quality, episode ORDER BY id DESC
+            ) AS copy,
+            COUNT(*) OVER (PARTITION BY release, quality, episode) AS copies
+        FROM (SELECT *, release_key(base_title) AS release FROM matches)
+    )
+    WHERE copy = 1
+    ORDER BY score
+    LIMIT :limit OFFSET :offset
+"""
+
+FUZZY_SQL = """
+    SELECT search_key, rank FROM title_trigrams WHERE title_trigrams MATCH ?
+    ORDER BY rank LIMIT ?
+"""
+
+GENERATION_SQL = "SELECT value FROM index_meta WHERE key = 'generation'"
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+# Trailing "SXX" or year of a request in the `Title SXX` / `Title Year` format
+QUERY_TAIL_PATTERN = re.compile(
+    r"^(?P<title>.*?)(?:\s+(?:S(?P<season>\d{1,2})|(?P<year>(?:19|20)\d{2})))?\s*$",
+    re.IGNORECASE,
+)
+
+
+class ParsedQuery(NamedTuple):
+    title_words: List[str]
+    year: Optional[int]
+    season: Optional[int]
+
+
+def parse_query(query: str) -> ParsedQuery:
+    """
+    Split a request into its title words and its year or season. The title
+    goes through the same normalizer as file names do at index time.
+    """
+    parts = QUERY_TAIL_PATTERN.match(query.strip())
+    # The pattern matches any string, the check only narrows the type
+    assert parts is not None
+
+    year = int(parts["year"]) if parts["year"] else None
+    season = int(parts["season"]) if parts["season"] else None
+    return ParsedQuery(normalize_title(parts["title"]).split(), year, season)
+
+
+def compile_query(parsed: ParsedQuery) -> Optional[str]:
+    """
+    Build the FTS5 expression for a parsed request.
+
+    Only the title words are matched, on the title columns, so neither the
+    year nor a season tag can hit captions or unrelated titles; those go
+    through the column filters instead. Each word may match in any title
+    column, and bm25() weighs where it did. The last word is a prefix so
+    partly typed titles still match. Returns None when there is no title
+    to match.
+    """
+    if not parsed.title_words:
+        return None
+
+    terms = [f'"{word}"' for word in parsed.title_words]
+    terms[-1] += "*"
+    return f"{{{' '.join(TITLE_COLUMNS)}}} : ({' '.join(terms)})"
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+def shard_files(shard_dir: str) -> List[str]:
+    if not os.path.isdir(shard_dir):
+        return []
+    return sorted(
+        os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith(".db")
+    )
+
+
+def collapse_shard_rows(rows: List[Tuple]) -> List[Tuple]:
+    """
+    Collapse re-uploads that ended up in different shards, such as the same
+    release posted in two channels, keeping the best ranked copy.
+    """
+    kept: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+    for row in rows:
+        key = (row[5], row[2], row[6])  # release key, quality, episode
+        if key in kept:
+            best = kept[key]
+            kept[key] = best[:4] + (best[4] + row[4] + 1,) + best[5:]
+        else:
+            kept[key] = row
+    return list(kept.values())
+
+
+class SearchPage(NamedTuple):
+    # Rows are (original_title, message_id, quality, channel), best match
+    # first; channel 0 stands for the bot's database channel
+    results: List[Tuple[str, int, str, int]]
+    offset: int
+    next_offset: Optional[int]  # None when there is nothing more to fetch
+    corrected: Optional[str] = None  # Spelling used when the query had typos
+    duplicates: int = 0  # Re-uploads left out of this page
+
+
+def _estimate_size(results: List[Tuple]) -> int:
+    # Rough footprint: string payloads plus a fixed per-row overhead
+    return 64 + sum(
+        64 + sum(len(value) for value in row if isinstance(value, str))
+        for row in results
+    )
+
+
+class ResultCache:
+    """
+    LRU cache of search results with a TTL and a byte budget.
+
+    Every entry belongs to the index generation it was read at. As soon as a
+    different generation is observed the whole cache is dropped, so a write
+    by the indexer is never hidden behind a cached answer.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_bytes: int = CACHE_MAX_BYTES,
+        ttl: float = CACHE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, SearchPage]]" = (
+            OrderedDict()
         )
-        results = cursor.fetchall()
+        self._generation: Optional[int] = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def _sync_generation(self, generation: int):
+        if generation != self._generation:
+            if self._entries:
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = generation
+
+    def get(self, key: Tuple, generation: int) -> Optional[SearchPage]:
+        with self._lock:
+            self._sync_generation(generation)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            expires_at, size, page = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return page
+
+    def put(self, key: Tuple, generation: int, page: SearchPage):
+        size = _estimate_size(page.results)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._sync_generation(generation)
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (time.monotonic() + self.ttl, size, page)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "generation": self._generation,
+            }
+
+
+class SearchBusyError(Exception):
+    """
+    Raised when too many queries are already waiting for a worker.
+    """
+
+
+class _QueryTicket:
+    """
+    Cancellation handle for one query running on a worker thread.
+    """
+
+    __slots__ = ("cancelled", "conns", "lock")
+
+    def __init__(self):
+        self.cancelled = False
+        # One connection per shard the query is running on
+        self.conns: List[sqlite3.Connection] = []
+        self.lock = threading.Lock()
+
+    def attach(self, conn: sqlite3.Connection):
+        with self.lock:
+            if self.cancelled:
+                raise sqlite3.OperationalError("interrupted")
+            self.conns.append(conn)
+
+    def detach(self, conn: sqlite3.Connection):
+        with self.lock:
+            self.conns.remove(conn)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            # Abort the statements already running on a connection
+            for conn in self.conns:
+                conn.interrupt()
+
+
+class SearchEngine:
+    """
+    Search the index through a fixed pool of read-only connections.
+
+    Connections are opened once with a tuned page cache and mmap window,
+    and the search statement is compiled on each of them up front. They run
+    in autocommit mode, so every query starts a fresh read transaction and
+    sees rows committed by the indexer in the meantime.
+
+    A connection is only ever used by one thread at a time: it is checked out
+    of the pool for the duration of a query and returned afterwards, which
+    makes one engine safe to share between the event loop and worker threads.
+
+    Coroutines use `search_async`, which runs the query on a bounded executor
+    with one worker per pooled connection, so the event loop never waits on
+    SQLite.
+
+    Matches are ranked with bm25() and served a page at a time, never past
+    MAX_RESULTS, so a one-word query can not pull the whole index.
+
+    A query that matches nothing is retried once with its words replaced by
+    the closest title words found through the `title_trigrams` index. The
+    lookup is limited in both candidates and time, and queries that do match
+    never pay for it.
+
+    Re-uploads of the same release are collapsed to their newest copy before
+    paging, so users get one file per title, quality and episode.
+
+    Pages are cached per normalized query until the index generation
+    stored in `index_meta` changes. The generation is read through a
+    dedicated connection, so a cache hit never waits for a pooled one.
+
+    Given a `shard_dir`, the engine searches every shard file in it instead
+    of `db_file`. Each shard gets its own pool, a query runs on all of them
+    at once and the ranked rows are merged by score. bm25() weighs terms by
+    the statistics of each shard, so the merged order is close to, but not
+    exactly, that of a single index. The directory is looked at again every
+    SHARD_RESCAN_INTERVAL seconds, so shards the indexer creates later are
+    searched as well; until the first one exists, searches find nothing.
+    """
+
+    def __init__(
+        self,
+        db_file: str = DB_FILE,
+        pool_size: int = POOL_SIZE,
+        shard_dir: Optional[str] = None,
+    ):
+        self.shard_dir = shard_dir
+        self.db_files: List[str] = []
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self._pools: List["queue.Queue[sqlite3.Connection]"] = []
+        self._closed = False
+
+        self.cache = ResultCache()
+        self._meta_conns: List[sqlite3.Connection] = []
+        self._meta_lock = threading.Lock()
+        # Distinct titles for autocomplete, loaded on the first `complete`
+        # and refreshed when the index changes
+        self.titles: List[TitleCatalog] = []
+        self._titles_loaded = False
+        self._titles_generation: Optional[int] = None
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="search"
+        )
+        # Every search worker can have a statement running on each shard;
+        # replaced by a larger one as shards are added
+        self._fanout: Optional[ThreadPoolExecutor] = None
+        self._fanout_size = 0
+        self._shards_lock = threading.Lock()
+        self._rescanned_at = 0.0
+
+        if shard_dir is None:
+            self._add_index(db_file)
+        else:
+            self._rescan_shards(force=True)
+
+        self._counters_lock = threading.Lock()
+        self._counters = {
+            "queued": 0,
+            "running": 0,
+            "max_queued": 0,
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "cancelled": 0,
+            "rejected": 0,
+            "fuzzy_lookups": 0,
+            "fuzzy_hits": 0,
+            "fuzzy_timeouts": 0,
+            "duplicates_suppressed": 0,
+        }
+
+        logger.info(
+            f"🔎 Search engine ready with {pool_size} connections to "
+            + (f"each of {len(self.db_files)} shards in {shard_dir}" if shard_dir else db_file)
+        )
+
+    def _add_index(self, path: str):
+        pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        conns = [self._connect(path) for _ in range(self.pool_size + 1)]
+        for conn in conns[1:]:
+            pool.put(conn)
+        titles = TitleCatalog()
+
+        # Readers index these lists by shard number up to len(db_files), so
+        # that list grows last
+        with self._meta_lock:
+            self._pools.append(pool)
+            self._meta_conns.append(conns[0])
+            self.titles.append(titles)
+            self.db_files.append(path)
+        self.db_file = self.db_files[0]
+
+    def _rescan_shards(self, force: bool = False):
+        """
+        Open shard files created since the last look at `shard_dir`. A
+        shard that can not be opened yet, such as one whose schema is still
+        being written, is tried again on the next rescan.
+        """
+        if self.shard_dir is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._rescanned_at < SHARD_RESCAN_INTERVAL:
+            return
+
+        with self._shards_lock:
+            if not force and now - self._rescanned_at < SHARD_RESCAN_INTERVAL:
+                return
+            self._rescanned_at = now
+            added = [path for path in shard_files(self.shard_dir) if path not in self.db_files]
+            for path in added:
+                try:
+                    self._add_index(path)
+                except sqlite3.Error as e:
+                    logger.warning(f"Shard {path} not searchable yet: {e}")
+                    continue
+                logger.info(f"🔎 Searching new shard {path}")
+
+            size = self.pool_size * len(self.db_files)
+            if len(self.db_files) > 1 and self._fanout_size < size:
+                old, self._fanout = self._fanout, ThreadPoolExecutor(
+                    max_workers=size, thread_name_prefix="shard"
+                )
+                self._fanout_size = size
+                if old is not None:
+                    # Queries already on it finish there
+                    old.shutdown(wait=False)
+
+    def _connect(self, db_file: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            f"file:{db_file}?mode=ro",
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute("PRAGMA query_only = ON")
+        conn.create_function("release_key", 1, release_key, deterministic=True)
+
+        # Load the schema and compile the search statement once
+        conn.execute(
+            SEARCH_SQL,
+            {
+                "match": '"warmup"',
+                "year": None,
+                "season": None,
+                "limit": 1,
+                "offset": 0,
+                "window": 1,
+            },
+        ).fetchall()
+        return conn
+
+    @contextmanager
+    def connection(self, shard: int = 0) -> Iterator[sqlite3.Connection]:
+        """
+        Check a connection to the `shard`-th index file out of its pool for
+        the duration of the block.
+        """
+        if self._closed:
+            raise RuntimeError("Search engine is closed")
+
+        pool = self._pools[shard]
+        conn = pool.get(timeout=ACQUIRE_TIMEOUT)
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
+
+    def generation(self) -> Optional[int]:
+        """
+        Current index generation, or None if the index predates it. With
+        shards it is the sum of theirs, which grows whenever any one does
+        or a new shard shows up.
+        """
+        self._rescan_shards()
+        total = 0
+        with self._meta_lock:
+            for conn in self._meta_conns:
+                try:
+                    row = conn.execute(GENERATION_SQL).fetchone()
+                except sqlite3.OperationalError:
+                    return None
+                total += row[0] if row else 0
+        return total
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        Indexed titles starting with `prefix`, for autocomplete and
+        "did you mean" suggestions. The first call loads every title, on a
+        pooled connection so searches keep the generation one.
+        """
+        generation = self.generation()
+        if not self._titles_loaded or generation != self._titles_generation:
+            for shard in range(len(self.db_files)):
+                with self.connection(shard) as conn:
+                    self.titles[shard].refresh(conn)
+            self._titles_loaded = True
+            self._titles_generation = generation
+        if len(self.titles) == 1:
+            return self.titles[0].complete(prefix, limit)
+        # Shards may share titles
+        matches = {title for titles in self.titles for title in titles.complete(prefix, limit)}
+        return sorted(matches)[:limit]
+
+    def search(
+        self,
+        query: str,
+        offset: int = 0,
+        limit: int = PAGE_SIZE,
+        ticket: Optional[_QueryTicket] = None,
+    ) -> SearchPage:
+        key = (normalize_query(query), offset, limit)
+        generation = self.generation()
+
+        if generation is not None:
+            page = self.cache.get(key, generation)
+            if page is not None:
+                return page
+
+        page = self._lookup(query, offset, limit, ticket)
+
+        if generation is not None:
+            self.cache.put(key, generation, page)
+        return page
+
+    def _fetch(
+        self,
+        sql: str,
+        params: Any,
+        ticket: Optional[_QueryTicket] = None,
+        budget: Optional[float] = None,
+    ) -> List[Tuple]:
+        """
+        Rows of `sql` from every index file, best first. Statements end with
+        their score column, which orders the rows of several shards.
+        """
+        shards = len(self.db_files)
+        fanout = self._fanout
+        if shards > 1 and fanout is not None:
+            futures = [
+                fanout.submit(self._fetch_shard, shard, sql, params, ticket, budget)
+                for shard in range(shards)
+            ]
+            rows = [row for future in futures for row in future.result()]
+        else:
+            # One index, none yet, or a shard added a moment ago
+            rows = [
+                row
+                for shard in range(shards)
+                for row in self._fetch_shard(shard, sql, params, ticket, budget)
+            ]
+        if shards > 1:
+            rows.sort(key=lambda row: row[-1])
+        return rows
+
+    def _fetch_shard(
+        self,
+        shard: int,
+        sql: str,
+        params: Any,
+        ticket: Optional[_QueryTicket] = None,
+        budget: Optional[float] = None,
+    ) -> List[Tuple]:
+        with self.connection(shard) as conn:
+            if budget is not None:
+                deadline = time.monotonic() + budget
+                conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+            if ticket is not None:
+                ticket.attach(conn)
+
+            try:
+                return conn.execute(sql, params).fetchall()
+            finally:
+                if ticket is not None:
+                    ticket.detach(conn)
+                if budget is not None:
+                    conn.set_progress_handler(None, 0)
+
+    def _lookup(
+        self,
+        query: str,
+        offset: int,
+        limit: int,
+        ticket: Optional[_QueryTicket] = None,
+    ) -> SearchPage:
+        page = self._query(query, offset, limit, ticket)
+
+        # Later pages are always fetched with the already corrected query
+        if page.results or offset > 0:
+            return page
+
+        corrected = self._correct(query, ticket)
+        if corrected is None:
+            return page
+
+        # A correction that finds nothing is not worth telling the user about
+        corrected_page = self._query(corrected, offset, limit, ticket)
+        if not corrected_page.results:
+            return page
+        self._count("fuzzy_hits")
+        return corrected_page._replace(corrected=corrected)
+
+    def _query(
+        self,
+        query: str,
+        offset: int,
+        limit: int,
+        ticket: Optional[_QueryTicket] = None,
+    ) -> SearchPage:
+        # Never page past the hard cap
+        limit = min(limit, MAX_RESULTS - offset)
+        if limit <= 0:
+            return SearchPage([], offset, None)
+
+        parsed = parse_query(query)
+        match = compile_query(parsed)
+        if match is None:
+            return SearchPage([], offset, None)
+
+        # Every page is cut from the top rows, so the rows of several shards
+        # can be merged first; one extra row tells whether another page exists
+        params = {
+            "match": match,
+            "year": parsed.year,
+            "season": parsed.season,
+            "limit": offset + limit + 1,
+            "offset": 0,
+            "window": COLLAPSE_WINDOW,
+        }
+        rows = self._fetch(SEARCH_SQL, params, ticket)
+        if len(self.db_files) > 1:
+            rows = collapse_shard_rows(rows)
+
+        rows = rows[offset:]
+        has_more = len(rows) > limit and offset + limit < MAX_RESULTS
+        rows = rows[:limit]
+
+        duplicates = sum(row[4] for row in rows)
+        if duplicates:
+            self._count("duplicates_suppressed", duplicates)
+
+        return SearchPage(
+            [row[:4] for row in rows],
+            offset,
+            offset + limit if has_more else None,
+            duplicates=duplicates,
+        )
+
+    def _correct(
+        self, query: str, ticket: Optional[_QueryTicket] = None
+    ) -> Optional[str]:
+        """
+        Respell the words of a query after the closest indexed title.
+
+        Candidates are titles sharing trigrams with the query. Every word of
+        three or more letters must then be close to some word of the same
+        title; numbers and short tags are kept as typed, but titles that
+        also contain the typed year or number score higher.
+
+        Returns:
+            Optional[str]: The corrected query, or None if nothing fits;
+                `_lookup` still drops one that matches no file
+        """
+        words = WORD_PATTERN.findall(query.casefold())
+        fuzzy_words = [word for word in words if word.isalpha() and len(word) >= 3]
+        number_words = [word for word in words if word.isdigit()]
+        if not fuzzy_words:
+            return None
+
+        trigrams: List[str] = []
+        for word in fuzzy_words:
+            for i in range(len(word) - 2):
+                if word[i : i + 3] not in trigrams:
+                    trigrams.append(word[i : i + 3])
+
+        match = " OR ".join(f'"{trigram}"' for trigram in trigrams[:FUZZY_MAX_TRIGRAMS])
+
+        self._count("fuzzy_lookups")
+        try:
+            rows = self._fetch(
+                FUZZY_SQL, (match, FUZZY_CANDIDATES), ticket, FUZZY_TIME_BUDGET
+            )
+        except sqlite3.OperationalError as e:
+            if ticket is not None and ticket.cancelled:
+                raise
+            if "interrupted" in str(e):
+                self._count("fuzzy_timeouts")
+            else:
+                logger.warning(f"Fuzzy lookup unavailable: {e}")
+            return None
+
+        # Titles share most of their words, so score each pair only once
+        ratios: Dict[Tuple[str, str], float] = {}
+        best_score, best_words = 0.0, None
+
+        for title, _ in rows[:FUZZY_CANDIDATES]:
+            title_words = set(WORD_PATTERN.findall(title.casefold()))
+            replacements = {}
+            total = 0.0
+
+            for word in fuzzy_words:
+                best_ratio, best_word = 0.0, word
+                for title_word in title_words:
+                    pair = (word, title_word)
+                    if pair not in ratios:
+                        ratios[pair] = SequenceMatcher(None, word, title_word).ratio()
+                    if ratios[pair] > best_ratio:
+                        best_ratio, best_word = ratios[pair], title_word
+
+                if best_ratio < FUZZY_MIN_SCORE:
+                    break
+                replacements[word] = best_word
+                total += best_ratio
+            else:
+                total += sum(word in title_words for word in number_words)
+                score = total / (len(fuzzy_words) + len(number_words))
+                if score > best_score:
+                    best_score, best_words = score, replacements
+
+        if best_words is None:
+            return None
+
+        corrected = " ".join(best_words.get(word, word) for word in words)
+        return corrected if corrected != " ".join(words) else None
+
+    async def search_async(
+        self,
+        query: str,
+        offset: int = 0,
+        limit: int = PAGE_SIZE,
+        timeout: float = SEARCH_TIMEOUT,
+    ) -> SearchPage:
+        """
+        Run a search on the worker pool without blocking the event loop.
+
+        If the query is still queued or running after `timeout` seconds, or
+        the awaiting task is cancelled, the statement is interrupted and the
+        worker is freed for the next query. The result cache is checked on
+        the worker as well, since reading the generation queries SQLite.
+        """
+        with self._counters_lock:
+            if self._counters["queued"] >= MAX_PENDING:
+                self._counters["rejected"] += 1
+                raise SearchBusyError(f"{MAX_PENDING} searches already pending")
+            self._counters["queued"] += 1
+            self._counters["max_queued"] = max(
+                self._counters["max_queued"], self._counters["queued"]
+            )
+
+        ticket = _QueryTicket()
+        future = self._executor.submit(self._run, ticket, query, offset, limit)
+        future.add_done_callback(self._on_done)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            ticket.cancel()
+            raise
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            ticket.cancel()
+            raise
+
+    async def complete_async(
+        self, prefix: str, limit: int = 10, timeout: float = SEARCH_TIMEOUT
+    ) -> List[str]:
+        """
+        `complete` on the worker pool: reading the generation and loading
+        new titles both query SQLite.
+        """
+        future = self._executor.submit(self.complete, prefix, limit)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            future.cancel()
+            raise
+
+    def _run(
+        self, ticket: _QueryTicket, query: str, offset: int, limit: int
+    ) -> SearchPage:
+        with self._counters_lock:
+            self._counters["queued"] -= 1
+            self._counters["running"] += 1
+        try:
+            return self.search(query, offset, limit, ticket)
+        finally:
+            with self._counters_lock:
+                self._counters["running"] -= 1
+
+    def _on_done(self, future: Future):
+        # A future cancelled before a worker picked it up never ran `_run`
+        if future.cancelled():
+            with self._counters_lock:
+                self._counters["queued"] -= 1
+        elif future.exception() is not None:
+            self._count("failed")
+        else:
+            self._count("completed")
+
+    def _count(self, key: str, amount: int = 1):
+        with self._counters_lock:
+            self._counters[key] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Snapshot of the queue depth, outcome counters and cache statistics.
+        """
+        with self._counters_lock:
+            stats: Dict[str, Any] = dict(self._counters)
+        stats["cache"] = self.cache.stats()
+        return stats
+
+    def close(self):
+        self._closed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._shards_lock:
+            if self._fanout is not None:
+                self._fanout.shutdown(wait=True)
+        for pool in self._pools:
+            for _ in range(self.pool_size):
+                pool.get().close()
+        for conn in self._meta_conns:
+            conn.close()
+
+
+_engine: Optional[SearchEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> SearchEngine:
+    """
+    Return the shared search engine, opening it on first use.
+    """
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SearchEngine(shard_dir=SHARD_DIR if SHARD_BY else None)
+    return _engine
+
+
+def search_files(query: str, offset: int = 0, limit: int = PAGE_SIZE):
+    try:
+        results = get_engine().search(query, offset, limit).results
     except sqlite3.OperationalError as e:
         print(f"❌ Error while searching: {e}")
         results = []
-    finally:
-        conn.close()
     return results
+
+
+async def search(
+    query: str,
+    offset: int = 0,
+    limit: int = PAGE_SIZE,
+    timeout: float = SEARCH_TIMEOUT,
+) -> SearchPage:
+    """
+    Async counterpart of `search_files` for use inside handlers.
+
+    Returns one ranked page; pass its `next_offset` back in to get the next
+    one. Timeouts surface as `asyncio.TimeoutError` and a full queue as
+    `SearchBusyError`, so the caller can tell the user to retry.
+    """
+    try:
+        page = await get_engine().search_async(query, offset, limit, timeout)
+    except sqlite3.OperationalError as e:
+        print(f"❌ Error while searching: {e}")
+        page = SearchPage([], offset, None)
+    return page
+
+
+def complete_titles(prefix: str, limit: int = 10) -> List[str]:
+    return get_engine().complete(prefix, limit)
+
+
+async def suggest_titles(prefix: str, limit: int = 10) -> List[str]:
+    """
+    Async counterpart of `complete_titles`. Suggestions are optional, so a
+    busy or failing index gives none instead of an error.
+    """
+    try:
+        return await get_engine().complete_async(prefix, limit)
+    except (asyncio.TimeoutError, sqlite3.Error) as e:
+        logger.warning(f"Title suggestions unavailable: {e}")
+        return []
+
+
+def search_stats() -> Dict[str, Any]:
+    return get_engine().stats()
@@ -0,0 +1,214 @@
+"""
+Split the search index into shards, or rebuild single shards.
+
+Sharding is turned on with INDEX_SHARD_BY ("channel" or "initial"); the
+shard files live in INDEX_SHARD_DIR. `--split` moves the rows of an
+existing index.db into shards, `--rebuild` scans the source channels again
+into fresh copies of the named shards and swaps them in, leaving every
+other shard alone.
+
+    python shard_index.py --split
+    python shard_index.py --list
+    python shard_index.py --rebuild initial_m initial_other
+"""
+
+import os
+import json
+import shutil
+import asyncio
+import sqlite3
+import argparse
+import functools
+from collections import defaultdict
+from typing import DefaultDict, List
+
+from telethon import TelegramClient
+from indexing_with_sqlite import (
+    API_HASH,
+    API_ID,
+    DB_FILE,
+    DUPLICATE_COLUMNS,
+    INDEX_CHANNELS,
+    MEDIA_COLUMNS,
+    MEDIA_INSERT_SQL,
+    SESSION_NAME,
+    SHARD_BY,
+    SHARD_DIR,
+    SHARD_MODES,
+    IndexWriter,
+    bump_generation,
+    init_db,
+    open_writer,
+    scan_channels,
+    shard_name,
+    shard_path,
+)
+from search_index import shard_files
+
+# Rows inserted per statement while splitting
+SPLIT_CHUNK = 50_000
+
+GENERATION_SQL = "SELECT coalesce(max(value), 0) FROM index_meta WHERE key = 'generation'"
+SEQUENCE_SQL = "SELECT coalesce(max(seq), 0) FROM sqlite_sequence WHERE name = 'media'"
+
+
+def split_index(db_file: str = DB_FILE, shard_by: str = SHARD_BY, shard_dir: str = SHARD_DIR):
+    """
+    Copy every file of `db_file` into its shard, keeping row IDs so
+    recorded duplicates still point at their originals. The rows stay in
+    `db_file` until it is compacted or deleted; only the checkpoints there
+    are used once sharding is on.
+    """
+    if shard_by not in SHARD_MODES:
+        print(f"❌ Set INDEX_SHARD_BY to one of {', '.join(SHARD_MODES)} first")
+        return
+    if shard_files(shard_dir):
+        print(f"❌ {shard_dir} already holds shards, rebuild them instead")
+        return
+
+    source = sqlite3.connect(db_file)
+    groups: DefaultDict[str, List[list]] = defaultdict(list)
+    shard_of = {}
+    channel_index = MEDIA_COLUMNS.index("channel")
+    key_index = MEDIA_COLUMNS.index("search_key")
+    for row in source.execute(f"SELECT {', '.join(MEDIA_COLUMNS)} FROM media ORDER BY id"):
+        name = shard_name(shard_by, row[channel_index], row[key_index])
+        groups[name].append(list(row))
+        shard_of[row[0]] = name
+
+    duplicates: DefaultDict[str, List[tuple]] = defaultdict(list)
+    original_index = DUPLICATE_COLUMNS.index("original_id")
+    for row in source.execute(f"SELECT {', '.join(DUPLICATE_COLUMNS)} FROM duplicate_files"):
+        if row[original_index] in shard_of:
+            duplicates[shard_of[row[original_index]]].append(row)
+    source.close()
+
+    os.makedirs(shard_dir, exist_ok=True)
+    for name, rows in sorted(groups.items()):
+        path = shard_path(name, shard_dir)
+        init_db(path, seed=False)
+        conn = open_writer(path)
+        with conn:
+            for i in range(0, len(rows), SPLIT_CHUNK):
+                conn.execute(MEDIA_INSERT_SQL, (json.dumps(rows[i : i + SPLIT_CHUNK]),))
+            conn.executemany(
+                f"""
+                    INSERT OR IGNORE INTO duplicate_files ({', '.join(DUPLICATE_COLUMNS)})
+                    VALUES ({', '.join('?' * len(DUPLICATE_COLUMNS))})
+                """,
+                duplicates[name],
+            )
+            bump_generation(conn.cursor())
+        conn.close()
+        print(f"📦 {name}: {len(rows)} files")
+
+    print(f"✅ Split {len(shard_of)} files into {len(groups)} shards in {shard_dir}")
+
+
+def swap_in_shard(rebuilt: str, live: str):
+    """
+    Replace a live shard with a rebuilt copy. An existing file is
+    overwritten in a single write transaction, so searches running on it
+    see either the old or the new shard whole.
+    """
+    if not os.path.exists(live):
+        os.replace(rebuilt, live)
+        return
+
+    conn = open_writer(live)
+    snapshot = sqlite3.connect(rebuilt)
+    try:
+        generation = conn.execute(GENERATION_SQL).fetchone()[0]
+        sequence = conn.execute(SEQUENCE_SQL).fetchone()[0]
+        snapshot.backup(conn)
+        # Both counters only move forward: readers compare the generation to
+        # drop cached results and the title index loads rows above the last ID
+        with conn:
+            conn.execute(
+                "UPDATE index_meta SET value = max(value, ?) + 1 WHERE key = 'generation'",
+                (generation,),
+            )
+            conn.execute(
+                "UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'media'",
+                (sequence,),
+            )
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        snapshot.close()
+        conn.close()
+    os.remove(rebuilt)
+
+
+async def rebuild_shards(
+    names: List[str], shard_by: str = SHARD_BY, shard_dir: str = SHARD_DIR
+):
+    """
+    Scan the source channels from the start into fresh copies of the named
+    shards, then swap them in.
+
+    The live shards keep serving searches meanwhile. Live updates written
+    to them during the rescan are not carried over; the next regular scan
+    and later edits bring them back.
+    """
+    if shard_by not in SHARD_MODES:
+        print(f"❌ Set INDEX_SHARD_BY to one of {', '.join(SHARD_MODES)} first")
+        return
+
+    work_dir = f"{shard_dir}.rebuild"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    # Fresh checkpoints too, so every channel is read from its first message.
+    # Not named *.db, which would make it a shard.
+    checkpoints = os.path.join(work_dir, "checkpoints.sqlite")
+    await asyncio.to_thread(init_db, checkpoints, False)
+    make_writer = functools.partial(IndexWriter, checkpoints, shard_by, work_dir, names)
+
+    try:
+        async with TelegramClient(SESSION_NAME, API_ID, API_HASH) as client:
+            await scan_channels(client, INDEX_CHANNELS, make_writer=make_writer)
+
+        for name in names:
+            rebuilt = shard_path(name, work_dir)
+            if not os.path.exists(rebuilt):
+                print(f"⚠️ {name}: no files found in {', '.join(INDEX_CHANNELS)}, left as is")
+                continue
+            await asyncio.to_thread(swap_in_shard, rebuilt, shard_path(name, shard_dir))
+            print(f"✅ {name} rebuilt")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def list_shards(shard_dir: str = SHARD_DIR):
+    paths = shard_files(shard_dir)
+    if not paths:
+        print(f"No shards in {shard_dir}")
+        return
+    for path in paths:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            files = conn.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+        finally:
+            conn.close()
+        size = os.path.getsize(path) / 1024 / 1024
+        print(f"   {os.path.basename(path)[:-3]:<24} {files:>9} files {size:>8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--split", action="store_true", help="Shard an existing index.db")
+    group.add_argument("--list", action="store_true", help="Show the shards and their sizes")
+    group.add_argument("--rebuild", nargs="+", metavar="SHARD", help="Shards to rebuild")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+
+    if args.split:
+        split_index(args.db)
+    elif args.list:
+        list_shards()
+    else:
+        asyncio.run(rebuild_shards(args.rebuild))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import re
+import sys
+import time
+import bisect
+import logging
+import sqlite3
+import threading
+from array import array
+from typing import Iterable, List, Tuple, Union
+
+from normalizer import _START
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+EXTENSION_PATTERN = re.compile(r"\.(?:mkv|mp4|avi|webm|m4v|mov|ts)$", re.IGNORECASE)
+SEPARATORS_PATTERN = re.compile(r"[\s._]+")
+# Season and episode tags, where the title of a series ends
+EPISODE_PATTERN = re.compile(
+    _START + r"(?:S\d{1,2}|Season[\s._-]?\d{1,2}|EP?[\s._-]?\d{1,3}|Episode[\s._-]?\d{1,3})",
+    re.IGNORECASE,
+)
+
+# Recent titles are kept in a small sorted list and merged into the packed
+# arrays once it grows past this size
+MAX_PENDING_TITLES = 2048
+
+SEPARATOR = "\n"
+# Between the key of an entry and the title shown for it
+DISPLAY_SEPARATOR = "\t"
+
+
+def title_key(title: str) -> str:
+    """
+    Lookup key of a title: case-folded words joined by single spaces.
+    """
+    return " ".join(WORD_PATTERN.findall(title.casefold()))
+
+
+def display_title(base_title: str) -> str:
+    """
+    A `base_title` as shown in suggestions: no file extension, and spaces
+    for the dots and underscores of release names.
+    """
+    title = EXTENSION_PATTERN.sub("", base_title)
+    return SEPARATORS_PATTERN.sub(" ", title).strip(" -")
+
+
+def work_title(base_title: str) -> str:
+    """
+    Display title of the film or series a `base_title` belongs to: the
+    episodes of a series all give the series title, e.g.
+
+        "Paatal.Lok.S01E02.Hindi.mkv" -> "Paatal Lok"
+    """
+    episode = EPISODE_PATTERN.search(base_title)
+    if episode is not None and episode.start() > 0:
+        base_title = base_title[: episode.start()]
+    return display_title(base_title)
+
+
+def title_entry(title: Union[str, Tuple[str, str]]) -> Tuple[str, str]:
+    """
+    Key and display title of a title, or of a (title, display title) pair.
+    Entries are stored as "key<TAB>display" and, since keys only hold words
+    and spaces, sort in key order.
+    """
+    title, display = title if isinstance(title, tuple) else (title, title)
+    return title_key(title), " ".join(display.split())
+
+
+class TitleIndex:
+    """
+    Sorted, packed set of distinct title keys for prefix lookups, each with
+    the title shown for it.
+
+    All entries live in one string, each followed by a newline, and an
+    `array` of start offsets keeps them in sorted order. A prefix lookup is
+    a binary search over the offsets followed by a short forward scan, so
+    it costs O(log n) slices regardless of how many titles are loaded,
+    with a fraction of the memory of a dict-of-dicts trie.
+
+    New titles go to a small sorted side list and are merged into the packed
+    arrays in bulk, so incremental updates never rebuild the big string one
+    title at a time.
+    """
+
+    __slots__ = ("_blob", "_offsets", "_pending", "_lock")
+
+    def __init__(self, titles: Iterable[Union[str, Tuple[str, str]]] = ()):
+        self._blob = ""
+        self._offsets = array("I")
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+        # The first display title of a key is kept
+        entries = {}
+        for title in titles:
+            key, display = title_entry(title)
+            if key and key not in entries:
+                entries[key] = key + DISPLAY_SEPARATOR + display
+        self._rebuild(entries.values())
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._pending)
+
+    def _rebuild(self, entries: Iterable[str]):
+        ordered = sorted(entries)
+        offsets = array("I")
+        position = 0
+        for entry in ordered:
+            offsets.append(position)
+            position += len(entry) + 1
+
+        self._blob = SEPARATOR.join(ordered) + SEPARATOR if ordered else ""
+        self._offsets = offsets
+
+    @staticmethod
+    def _key_at(blob: str, offsets: array, i: int) -> str:
+        start = offsets[i]
+        return blob[start : blob.index(DISPLAY_SEPARATOR, start)]
+
+    @staticmethod
+    def _lower_bound(blob: str, offsets: array, prefix: str) -> int:
+        lo, hi = 0, len(offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if TitleIndex._key_at(blob, offsets, mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _has_key(self, key: str, pending: List[str]) -> bool:
+        blob, offsets = self._blob, self._offsets
+        i = self._lower_bound(blob, offsets, key)
+        if i < len(offsets) and self._key_at(blob, offsets, i) == key:
+            return True
+        j = bisect.bisect_left(pending, key)
+        return j < len(pending) and pending[j].startswith(key + DISPLAY_SEPARATOR)
+
+    def __contains__(self, title: str) -> bool:
+        return self._has_key(title_key(title), self._pending)
+
+    def add(self, titles: Iterable[Union[str, Tuple[str, str]]]) -> int:
+        """
+        Add titles that are not indexed yet, as plain titles or (title,
+        display title) pairs.
+
+        Returns:
+            int: Number of new distinct titles
+        """
+        added = 0
+        with self._lock:
+            # Readers keep using the old list until the new one is swapped in
+            pending = list(self._pending)
+            for title in titles:
+                key, display = title_entry(title)
+                if not key or self._has_key(key, pending):
+                    continue
+                bisect.insort(pending, key + DISPLAY_SEPARATOR + display)
+                added += 1
+
+            if len(pending) > MAX_PENDING_TITLES:
+                blob = self._blob
+                merged = blob.split(SEPARATOR)[:-1] if blob else []
+                self._rebuild(merged + pending)
+                pending = []
+            self._pending = pending
+        return added
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        Display titles of up to `limit` keys starting with `prefix`, in
+        key order.
+        """
+        prefix = title_key(prefix)
+        if not prefix:
+            return []
+
+        # Snapshot both parts so a concurrent merge can not tear the scan
+        blob, offsets, pending = self._blob, self._offsets, self._pending
+        matches = []
+
+        i = self._lower_bound(blob, offsets, prefix)
+        while i < len(offsets) and len(matches) < limit:
+            entry = blob[offsets[i] : blob.index(SEPARATOR, offsets[i])]
+            if not entry.startswith(prefix):
+                break
+            matches.append(entry)
+            i += 1
+
+        j = bisect.bisect_left(pending, prefix)
+        while j < len(pending) and pending[j].startswith(prefix):
+            matches.append(pending[j])
+            j += 1
+
+        return [entry.partition(DISPLAY_SEPARATOR)[2] for entry in sorted(matches)[:limit]]
+
+    def memory_usage(self) -> int:
+        """
+        Approximate bytes held by the index.
+        """
+        return (
+            sys.getsizeof(self._blob)
+            + sys.getsizeof(self._offsets)
+            + sys.getsizeof(self._pending)
+            + sum(sys.getsizeof(entry) for entry in self._pending)
+        )
+
+
+class TitleCatalog:
+    """
+    A `TitleIndex` of the distinct films and series in the index database,
+    see `work_title`, kept current by loading only the rows added since the
+    last refresh. Nothing is loaded until the first refresh.
+    """
+
+    def __init__(self):
+        self.index = TitleIndex()
+        self._last_rowid = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, conn: sqlite3.Connection) -> int:
+        """
+        Add titles of rows written since the last refresh.
+
+        Titles of deleted rows are kept; a stale suggestion simply finds no
+        files when it is searched.
+
+        Returns:
+            int: Number of new rows read
+        """
+        with self._lock:
+            started = time.perf_counter()
+            rows = conn.execute(
+                "SELECT id, base_title FROM media WHERE id > ? ORDER BY id",
+                (self._last_rowid,),
+            ).fetchall()
+
+            if rows and self._last_rowid == 0:
+                # First load: build the packed arrays in one go
+                self.index = TitleIndex(work_title(title) for _, title in rows)
+                elapsed = (time.perf_counter() - started) * 1000
+                logger.info(
+                    f"🔤 Title index loaded {len(self.index)} distinct titles from {len(rows)} rows "
+                    f"in {elapsed:.0f} ms, using {self.index.memory_usage() / 1024 / 1024:.1f} MiB"
+                )
+            elif rows:
+                self.index.add(work_title(title) for _, title in rows)
+            if rows:
+                self._last_rowid = rows[-1][0]
+        return len(rows)
+
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        return self.index.complete(prefix, limit)